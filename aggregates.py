@@ -0,0 +1,263 @@
+# %%
+import itertools
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from periods import PERIODS_PER_YEAR, month_keys, period_calendar, period_keys, period_values
+from profiling import stage
+
+#%% Cube layout
+DIMENSIONS = ['Distribution channel', 'Region', 'Division', 'Type of product']
+MEASURES = ['Sales amount', 'Total volume', 'Actual sales volume', 'Free of charge (Volume)', 'Sales return volume']
+TIME_PERIODS = ['Month', 'Quarter']
+ALL = 'ALL' # Label of a dimension that has been summed across
+
+# Rolling/cumulative views of the dashboard measures, precomputed into the cube as '<measure> <window>' columns
+ROLLING_BASES = ['Sales amount', 'Total volume', 'Actual sales volume']
+ROLLING_WINDOWS = ['YTD', 'TTM', '3M avg']
+ROLLING_METRICS = [f'{measure} {window}' for measure in ROLLING_BASES for window in ROLLING_WINDOWS]
+METRICS = MEASURES + ROLLING_METRICS
+
+#%%
+@stage('build_cube')
+def build_cube(df):
+    """Pre-aggregate all measures for every dimension combination at Month and Quarter grain
+
+    Returns {time_period: DataFrame} indexed by DIMENSIONS + [time_period], with
+    every subset of dimensions also rolled up under the 'ALL' label, holding
+    MEASURES and the ROLLING_METRICS (see add_rolling_metrics). Measures missing
+    from df (see data_processing.compact_dataset) are left out, and the sums keep
+    the dtype of the rows, so a float32 dataset gives a float32 cube.
+    """
+    measures = [measure for measure in MEASURES if measure in df.columns]
+    keys = month_keys(df['Month'])
+    cube = {}
+    for time_period in TIME_PERIODS:
+        # Quarters are grouped on integer keys and only labelled once aggregated
+        period = df['Month'] if time_period == 'Month' else keys // 3
+        rows = df[DIMENSIONS + measures].assign(**{time_period: period})
+        base = rows.groupby(DIMENSIONS + [time_period], observed=True)[measures].sum().reset_index()
+        if time_period == 'Quarter':
+            base[time_period] = period_values(base[time_period], time_period)
+
+        # Roll-ups are summed from the base aggregate, not from the row-level data
+        parts = []
+        for rolled_up in itertools.product([False, True], repeat=len(DIMENSIONS)):
+            keep = [dim for dim, rolled in zip(DIMENSIONS, rolled_up) if not rolled]
+            part = base.groupby(keep + [time_period], observed=True)[measures].sum().reset_index()
+            parts.append(part.assign(**{dim: ALL for dim, rolled in zip(DIMENSIONS, rolled_up) if rolled}))
+
+        cube[time_period] = pd.concat(parts, ignore_index=True).set_index(DIMENSIONS + [time_period]).sort_index()
+    add_rolling_metrics(cube, period_calendar(df['Month'].min(), df['Month'].max()) if len(df) else None)
+    return cube
+
+@stage('build_cube')
+def build_cube_by_parts(frames):
+    """build_cube of the rows of several frames, holding only one frame's rows at a time
+
+    frames: iterable of row frames covering disjoint whole quarters (e.g. one per year).
+    Each is aggregated on its own; the rolling metrics are then recomputed across all of them.
+    """
+    parts = [build_cube(df) for df in frames]
+    cube = {time_period: pd.concat([part[time_period].drop(columns=ROLLING_METRICS) for part in parts]).sort_index()
+            for time_period in TIME_PERIODS}
+    return add_rolling_metrics(cube)
+
+def _rolling_windows(monthly, fiscal_years):
+    """{window: series x month array} of YTD sums, trailing 12-month sums and 3-month averages
+
+    monthly has one row per series and one column per calendar month (gaps as 0),
+    fiscal_years the fiscal year of every column. Windows reaching back before the
+    first month are NaN rather than partial.
+    """
+    n_months = monthly.shape[1]
+    def trailing(window):
+        result = np.full(monthly.shape, np.nan)
+        if n_months >= window: # Sum of shifted slices - exact zeros stay zero, unlike prefix-sum differences
+            result[:, window - 1:] = sum(monthly[:, lag:n_months - window + 1 + lag] for lag in range(window))
+        return result
+
+    ytd = np.empty(monthly.shape)
+    for year in np.unique(fiscal_years): # Running sum restarts at every fiscal year start
+        in_year = fiscal_years == year
+        ytd[:, in_year] = monthly[:, in_year].cumsum(axis=1)
+    return {'YTD': ytd, 'TTM': trailing(12), '3M avg': trailing(3) / 3}
+
+def _series_keys(month_index, quarter_index):
+    """One integer per dimension combination, comparable between the Month and Quarter tables"""
+    month_codes, quarter_codes, sizes = [], [], []
+    for level, dimension in enumerate(DIMENSIONS):
+        values = month_index.levels[level]
+        month_codes.append(month_index.codes[level])
+        quarter_codes.append(values.get_indexer(quarter_index.levels[level])[quarter_index.codes[level]])
+        sizes.append(len(values))
+    return np.ravel_multi_index(month_codes, sizes), np.ravel_multi_index(quarter_codes, sizes)
+
+def add_rolling_metrics(cube, calendar=None):
+    """Add the ROLLING_METRICS columns to both grains of the cube in place
+
+    Computed on the gap-free month grid of the period calendar (see periods.py), so
+    YTD follows the configured fiscal year; a quarter takes the value as of its last
+    month (e.g. 'TTM' of 2025Q1 is the trailing twelve months to March). Only periods
+    where the series has data get a row, as for the base measures.
+    """
+    month_table, quarter_table = cube['Month'], cube['Quarter']
+    if month_table.empty:
+        for table in (month_table, quarter_table):
+            table[ROLLING_METRICS] = float('nan')
+        return cube
+
+    # Row/column position of every cube row on the dense series x month grid
+    month_series, quarter_series = _series_keys(month_table.index, quarter_table.index)
+    series, series_codes = np.unique(month_series, return_inverse=True)
+    quarter_codes = np.searchsorted(series, quarter_series)
+    months = month_keys(month_table.index.get_level_values('Month'))
+    if calendar is None:
+        calendar = period_calendar(*period_values([months.min(), months.max()], 'Month'))
+    first_month = calendar.index[0]
+    month_positions = months - first_month
+
+    # Position of the last month of every quarter, straight from the integer keys
+    quarter_keys = period_keys(quarter_table.index.get_level_values('Quarter'), 'Quarter')
+    quarter_positions = np.minimum(quarter_keys * 3 + 2 - first_month, len(calendar) - 1)
+
+    for measure in ROLLING_BASES:
+        monthly = np.zeros((len(series), len(calendar)))
+        monthly[series_codes, month_positions] = month_table[measure].to_numpy()
+        dtype = np.result_type(month_table[measure].dtype, np.float32) # float32 cubes stay float32
+        for window, values in _rolling_windows(monthly, calendar['Fiscal year'].to_numpy()).items():
+            month_table[f'{measure} {window}'] = values[series_codes, month_positions].astype(dtype)
+            quarter_table[f'{measure} {window}'] = values[quarter_codes, quarter_positions].astype(dtype)
+    return cube
+
+def series_matrix(table, columns, time_period):
+    """Cube table columns as dense series x period arrays (gaps as 0)
+
+    Returns (series, sizes, first_key, {column: array}): series are the raveled codes of the
+    dimension levels (np.unravel_index(series, sizes) gives them back), array columns are the
+    consecutive period keys from first_key (see periods.period_keys).
+    """
+    index = table.index
+    sizes = [len(index.levels[level]) for level in range(len(DIMENSIONS))]
+    series, series_codes = np.unique(np.ravel_multi_index(index.codes[:len(DIMENSIONS)], sizes), return_inverse=True)
+    keys = period_keys(index.levels[-1], time_period)[index.codes[-1]]
+    first_key = keys.min()
+    arrays = {}
+    for column in columns:
+        arrays[column] = np.zeros((len(series), keys.max() - first_key + 1))
+        arrays[column][series_codes, keys - first_key] = table[column].to_numpy()
+    return series, sizes, first_key, arrays
+
+def cube_slice(cube, time_period, channels, divisions, regions=(ALL,), products=(ALL,)):
+    """Aggregated rows for a selection ('ALL' in a list means summed across that dimension)
+
+    Returns a flat frame with time_period, the four dimensions and the measures -
+    one row per selected series and period.
+    """
+    table = cube[time_period]
+    keys = []
+    for level, selected in enumerate((channels, regions, divisions, products)):
+        values = table.index.levels[level]
+        keys.append([ALL] if ALL in selected else [value for value in selected if value in values])
+    if not all(keys):
+        return table.iloc[:0].reset_index()
+    try:
+        return table.iloc[table.index.get_locs(keys + [slice(None)])].reset_index()
+    except KeyError: # Every value exists, but not in this combination
+        return table.iloc[:0].reset_index()
+
+def cube_periods(cube, start, end):
+    """Cube restricted to the months start..end ('YYYY-MM', inclusive)
+
+    Rows are selected rather than re-aggregated, so the rolling metrics keep their full
+    history (YTD of June still counts January when the range starts in March). Quarter
+    rows are those of every quarter the range touches, each holding the whole quarter.
+    """
+    first, last = month_keys([start, end])
+    bounds = {'Month': (first, last), 'Quarter': (first // 3, last // 3)}
+    sliced = {}
+    for time_period in TIME_PERIODS:
+        table = cube[time_period]
+        index = table.index
+        keys = period_keys(index.levels[-1], time_period)[index.codes[-1]]
+        low, high = bounds[time_period]
+        rows = table[(keys >= low) & (keys <= high)]
+        sliced[time_period] = rows.set_axis(rows.index.remove_unused_levels())
+    return sliced
+
+#%% Year-over-year
+def _with_period_keys(index, keys):
+    """index with its last (period) level replaced by integer period keys"""
+    if isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_arrays([index.get_level_values(level) for level in range(index.nlevels - 1)] + [keys])
+    return pd.Index(keys)
+
+def yoy_percent(values, time_period):
+    """% change of every value against the same series one year earlier, in one lagged lookup
+
+    values: Series or DataFrame whose last index level holds the periods (Month timestamps
+    or 'YYYYQn' labels), one row per series and period. Values are aligned on integer
+    period keys, so a missing prior-year period gives NaN rather than an older period.
+    """
+    index = values.index
+    keys = period_keys(index.get_level_values(-1), time_period)
+    lookup = values.set_axis(_with_period_keys(index, keys))
+    prior = lookup.reindex(_with_period_keys(index, keys - PERIODS_PER_YEAR[time_period])).set_axis(index)
+    return (values / prior - 1) * 100
+
+def yoy_change(grouped, time_period, metric, series_columns=('Distribution channel', 'Division')):
+    """Add a 'YoY' % change column for every series of a tidy table (see yoy_percent)"""
+    values = grouped.set_index(list(series_columns) + [time_period])[metric]
+    return grouped.assign(YoY=yoy_percent(values, time_period).to_numpy())
+
+#%% Summary statistics
+SUMMARY_MEASURES = ['Sales amount', 'Total volume', 'Actual sales volume']
+SEQUENTIAL_CHANGE = {'Month': 'MoM', 'Quarter': 'QoQ'} # Change against the immediately preceding period
+
+# Summary of a selection as of one period: table indexed by measure with the value,
+# the same period last year, the preceding period and the % changes against both
+Summary = namedtuple('Summary', ['period', 'label', 'table'])
+
+def shift_period(period, time_period, periods):
+    """A single Month timestamp or 'YYYYQn' label moved back by a number of periods"""
+    return period_values(period_keys([period], time_period) - periods, time_period)[0]
+
+def period_label(period, time_period):
+    """'June 2025' for months, '2025Q2' for quarters"""
+    return str(period) if time_period == 'Quarter' else period.strftime('%B %Y')
+
+def _percent_change(current, prior):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(prior != 0, (current / prior - 1) * 100, np.nan)
+
+@stage('summarize')
+def summarize(cube, time_period, channels, divisions, regions=(ALL,), products=(ALL,), as_of=None, measures=SUMMARY_MEASURES,
+              history=None):
+    """All summary measures of a selection for one period, a year earlier and one period earlier
+
+    as_of defaults to the latest period the selection has data for. The three periods
+    are reduced from the cube in a single grouped sum; a comparison period without
+    data, or with a zero value, gives NaN for its % change. history: cube the comparison
+    periods are looked up in when cube only holds a Period range (see cube_periods).
+    """
+    rows = cube_slice(cube, time_period, channels, divisions, regions, products)
+    measures = [measure for measure in measures if measure in rows.columns]
+    sequential = SEQUENTIAL_CHANGE[time_period]
+    columns = ['Value', 'Prior year', 'YoY %', 'Prior period', f'{sequential} %']
+    if as_of is None:
+        as_of = rows[time_period].max() if len(rows) else None
+    if as_of is None:
+        return Summary(None, '', pd.DataFrame(np.nan, index=measures, columns=columns))
+    if history is not None:
+        rows = cube_slice(history, time_period, channels, divisions, regions, products)
+
+    periods = pd.Index([as_of, shift_period(as_of, time_period, PERIODS_PER_YEAR[time_period]), shift_period(as_of, time_period, 1)])
+    positions = periods.get_indexer(rows[time_period])
+    in_periods = positions >= 0
+    sums = (rows.loc[in_periods, measures].groupby(positions[in_periods]).sum()
+            .reindex(range(len(periods))).to_numpy(dtype=float)) # Periods without data stay NaN
+    current, prior_year, prior_period = sums
+    table = pd.DataFrame({'Value': current, 'Prior year': prior_year, 'YoY %': _percent_change(current, prior_year),
+                          'Prior period': prior_period, f'{sequential} %': _percent_change(current, prior_period)},
+                         index=measures)
+    return Summary(as_of, period_label(as_of, time_period), table)
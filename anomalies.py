@@ -0,0 +1,122 @@
+# %%
+import numpy as np
+import pandas as pd
+from aggregates import ALL, DIMENSIONS, ROLLING_BASES, series_matrix
+from periods import PERIODS_PER_YEAR, period_values
+from profiling import stage
+
+# Scan of every monthly series of the cube for unusual moves, run once per data load.
+# Each check turns a series into log changes and scores them with a robust z-score
+# (median/MAD of the series' own history), so one mis-scaled month cannot hide itself
+# by inflating the standard deviation.
+ANOMALY_CHECKS = ['MoM', 'YoY', 'Seasonal']
+ANOMALY_MEASURES = ROLLING_BASES + ['Average price'] # Price = Sales amount / Actual sales volume
+ANOMALY_Z = 3.5 # |robust z| from which a change is reported
+MIN_CHANGES = 6 # Changes a series needs before it is scored
+MIN_SCALE = 0.05 # Floor of the MAD scale (log units), so near-constant series do not flag tiny moves
+MAD_SCALE = 1.4826 # Makes the MAD comparable to a standard deviation
+ANOMALY_COLUMNS = ['Measure', 'Check', 'Value', 'Compared with', 'Change %', 'Robust z']
+
+#%% Checks
+def _log(values):
+    """Log of the positive values, NaN elsewhere (zeros and gaps have no relative change)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(np.where(values > 0, values, np.nan))
+
+def _lag(values, periods):
+    lagged = np.full_like(values, np.nan)
+    lagged[:, periods:] = values[:, :-periods]
+    return lagged
+
+def _nanmedian(values):
+    """Median over the last axis ignoring NaN (NaN where all are NaN)
+
+    Sort-based: np.sort puts NaN last, so the median sits at the middle of each row's valid part.
+    Much faster than np.nanmedian on wide 2-D arrays.
+    """
+    ordered = np.sort(values, axis=-1)
+    n_valid = (~np.isnan(values)).sum(axis=-1, keepdims=True)
+    low = np.take_along_axis(ordered, np.maximum(n_valid - 1, 0) // 2, axis=-1)
+    high = np.take_along_axis(ordered, n_valid // 2 - (n_valid == 0), axis=-1)
+    return np.where(n_valid > 0, (low + high) / 2, np.nan)
+
+def _robust_z(changes):
+    """(changes - median) / (MAD_SCALE * MAD) per series (row), NaN for series with too few changes"""
+    median = _nanmedian(changes)
+    mad = _nanmedian(np.abs(changes - median))
+    z = (changes - median) / np.maximum(MAD_SCALE * mad, MIN_SCALE)
+    z[(~np.isnan(changes)).sum(axis=1) < MIN_CHANGES] = np.nan
+    return z
+
+def _log_baselines(log_values):
+    """{check: series x month array of the log of the value each month is compared with}
+
+    Seasonal compares with the same month last year, grown by the median
+    year-over-year change of the three months before.
+    """
+    last_year = _lag(log_values, PERIODS_PER_YEAR['Month'])
+    yoy = log_values - last_year
+    recent_growth = _nanmedian(np.stack([_lag(yoy, lag) for lag in (1, 2, 3)], axis=-1))[..., 0]
+    return {'MoM': _lag(log_values, 1), 'YoY': last_year, 'Seasonal': last_year + recent_growth}
+
+#%% Scan
+@stage('scan_anomalies')
+def scan_anomalies(cube):
+    """Unusual monthly changes of every series and ANOMALY_MEASURES, as an indexed table
+
+    Returns rows indexed by ['Month'] + DIMENSIONS (sorted, so a month or a selection
+    is a cheap index lookup - see select_anomalies) with the ANOMALY_COLUMNS, largest
+    |Robust z| first within each series and month.
+    """
+    table = cube['Month']
+    measures = [measure for measure in ROLLING_BASES if measure in table.columns]
+    index_names = ['Month'] + DIMENSIONS
+    if table.empty or not measures:
+        empty = pd.DataFrame(columns=ANOMALY_COLUMNS, index=pd.MultiIndex.from_tuples([], names=index_names))
+        return empty.astype({column: float for column in ANOMALY_COLUMNS[2:]})
+
+    series, sizes, first_key, arrays = series_matrix(table, measures, 'Month')
+    if {'Sales amount', 'Actual sales volume'} <= set(arrays):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arrays['Average price'] = np.where(arrays['Actual sales volume'] > 0, # VND per unit
+                                               arrays['Sales amount'] * 1e9 / arrays['Actual sales volume'], 0.0)
+
+    found = []
+    for measure, values in arrays.items():
+        log_values = _log(values)
+        for check, log_baseline in _log_baselines(log_values).items():
+            changes = log_values - log_baseline
+            z = _robust_z(changes)
+            with np.errstate(invalid='ignore'):
+                rows, months = np.nonzero(np.abs(z) >= ANOMALY_Z)
+            found.append(pd.DataFrame({
+                'month_key': first_key + months, 'series': series[rows], 'Measure': measure, 'Check': check,
+                'Value': values[rows, months], 'Compared with': np.exp(log_baseline[rows, months]),
+                'Change %': np.expm1(changes[rows, months]) * 100, 'Robust z': z[rows, months],
+            }))
+    found = pd.concat(found, ignore_index=True)
+
+    # Index levels reuse the cube's dimension labels
+    levels = [period_values(np.unique(found['month_key']), 'Month')] + [table.index.levels[level] for level in range(len(DIMENSIONS))]
+    codes = [np.searchsorted(np.unique(found['month_key']), found['month_key'])] + list(np.unravel_index(found['series'].to_numpy(), sizes))
+    found.index = pd.MultiIndex(levels=levels, codes=codes, names=index_names, verify_integrity=False)
+    found = found.assign(order=-found['Robust z'].abs()).sort_values('order', kind='stable').sort_index(kind='stable')
+    return found[ANOMALY_COLUMNS].astype({'Measure': 'category', 'Check': 'category'})
+
+def select_anomalies(anomalies, start=None, end=None, channels=(ALL,), divisions=(ALL,), regions=(ALL,), products=(ALL,),
+                     all_series=False):
+    """Anomalies of the months start..end for the selected series (all_series=True: every series)
+
+    'ALL' in a selection means the series summed across that dimension, as in aggregates.cube_slice.
+    """
+    months = slice(start, end)
+    if all_series:
+        return anomalies.loc[months]
+    keys = [months]
+    for level, selected in enumerate((channels, regions, divisions, products), start=1):
+        values = anomalies.index.levels[level]
+        keys.append([ALL] if ALL in selected else [value for value in selected if value in values])
+    try:
+        return anomalies.iloc[anomalies.index.get_locs(keys)]
+    except KeyError: # No anomaly for any selected series in these months
+        return anomalies.iloc[:0]
@@ -0,0 +1,55 @@
+# %%
+"""Compare wall time and peak memory of the raw workbook readers
+
+Each reader runs in a fresh subprocess so peak RSS is measured per engine:
+    python benchmarks/bench_reader.py [--workbook PATH] [--repeat N]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+ENGINES = ['pandas', 'openpyxl', 'calamine']
+
+# Runs inside the child process: read + clean once, report wall time and peak RSS
+CHILD_SCRIPT = '''
+import json, resource, sys, time
+sys.path.insert(0, {repo!r})
+import data_processing as dp
+start = time.perf_counter()
+raw = dp.read_raw_workbook(dp.Path({workbook!r}), {engine!r})
+df = dp.clean_data(raw, streamed={engine!r} != 'pandas')
+elapsed = time.perf_counter() - start
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': elapsed, 'peak_rss_mb': peak_kb / 1024, 'rows': len(df)}}))
+'''
+
+#%%
+def run_engine(workbook, engine):
+    script = CHILD_SCRIPT.format(repo=str(REPO_DIR), workbook=str(workbook), engine=engine)
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workbook', type=Path, default=REPO_DIR / 'Sales Report by Month Raw Data.xlsx')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"engine":<10} {"best s":>8} {"peak MB":>9} {"rows":>8}')
+    for engine in ENGINES:
+        runs = [run_engine(args.workbook, engine) for _ in range(args.repeat)]
+        if 'error' in runs[0]:
+            print(f'{engine:<10} skipped: {runs[0]["error"]}')
+            continue
+        best = min(run['seconds'] for run in runs)
+        peak = max(run['peak_rss_mb'] for run in runs)
+        print(f'{engine:<10} {best:>8.3f} {peak:>9.1f} {runs[0]["rows"]:>8}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# %%
+"""Benchmark suite for the cleaning and dashboard query paths
+
+Runs on synthetic exports at 10x/100x (optionally 1000x) the current workbook
+and appends one JSON line per measurement to benchmarks/results.jsonl:
+    python benchmarks/run_benchmarks.py --scales 10 100
+    python benchmarks/run_benchmarks.py --compare          # latest run vs the one before
+"""
+import argparse
+import datetime as dt
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import data_processing as dp
+from aggregates import build_cube, shift_period, summarize
+from anomalies import scan_anomalies
+from bridge import price_volume_mix
+from forecast import FORECAST_MODELS, forecast_cube
+from periods import PERIODS_PER_YEAR
+from streamlit_app import plot_sales_by_month
+from synthetic_data import synthetic_regions, synthetic_workbook
+
+RESULTS_FILE = BENCH_DIR / 'results.jsonl'
+DATA_DIR = BENCH_DIR / 'data'
+
+SELECTIONS = {
+    'all': (['ALL'], ['ALL']),
+    'specific': (['GT', 'MT', 'ECOM'], ['CAC', 'RAC', 'Refrigerator']),
+    'many': (['GT', 'MT', 'ECOM', 'Retail', 'Others'], ['CAC', 'RAC', 'Refrigerator', 'Television', 'Washing Machine', 'Others']),
+}
+
+#%% Helpers
+def timed(func, repeat):
+    """Best and median wall time of `repeat` calls"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'best_s': min(times), 'median_s': statistics.median(times), 'repeat': repeat}
+
+def sandbox_data_processing(raw_path, work_dir, scale):
+    """Point data_processing at the synthetic export and keep its outputs out of the repo"""
+    dp.RAW_DATA_FILE = raw_path
+    dp.CLEANED_CSV_FILE = work_dir / 'cleaned.csv'
+    dp.CACHE_DIR = work_dir / 'cache'
+    dp.CACHE_DATA_FILE = dp.CACHE_DIR / 'cleaned_data.parquet'
+    dp.CACHE_META_FILE = dp.CACHE_DIR / 'cleaned_data.json'
+    dp.CATEGORIES_FILE = dp.CACHE_DIR / 'categories.json'
+
+    # Accept the extra synthetic regions ('North 2', ...) on top of the real known labels
+    known = pd.read_csv(dp.current_dir / 'known_labels.csv')
+    extra = pd.DataFrame({'dimension': 'Region', 'label': synthetic_regions(scale)})
+    dp.KNOWN_LABELS_FILE = work_dir / 'known_labels.csv'
+    pd.concat([known, extra]).drop_duplicates().to_csv(dp.KNOWN_LABELS_FILE, index=False)
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True)
+    return result.stdout.strip() or 'unknown'
+
+#%% Suite
+def run_suite(scale, file_format, repeat):
+    """Yield (benchmark, params, timing) for one data scale"""
+    raw_path = synthetic_workbook(scale, DATA_DIR, file_format)
+    with tempfile.TemporaryDirectory() as tmp:
+        sandbox_data_processing(raw_path, Path(tmp), scale)
+
+        yield 'load_and_clean_data', {'cache': 'off'}, timed(lambda: dp.load_and_clean_data(use_cache=False), repeat)
+        df = dp.load_and_clean_data() # Populates the cache
+        yield 'load_and_clean_data', {'cache': 'hit'}, timed(dp.load_and_clean_data, repeat)
+        yield 'build_cube', {'rows': len(df)}, timed(lambda: build_cube(df), repeat)
+
+        cube = build_cube(df)
+        yield 'scan_anomalies', {'rows': len(df)}, timed(lambda: scan_anomalies(cube), repeat)
+        for time_period in ['Month', 'Quarter']:
+            for model in FORECAST_MODELS:
+                yield 'forecast_cube', {'time_period': time_period, 'model': model}, timed(
+                    lambda: forecast_cube(cube, time_period, 'Sales amount', model), repeat)
+        for time_period in ['Month', 'Quarter']:
+            for selection, (channels, divisions) in SELECTIONS.items():
+                for show_yoy in [False, True]:
+                    params = {'time_period': time_period, 'selection': selection, 'show_yoy': show_yoy}
+                    yield 'plot_sales_by_month', params, timed(
+                        lambda: plot_sales_by_month(cube, channels, divisions, 'Sales amount', time_period, show_yoy), repeat)
+                yield 'summarize', {'time_period': time_period, 'selection': selection}, timed(
+                    lambda: summarize(cube, time_period, channels, divisions), repeat)
+                latest = cube[time_period].index.levels[-1][-1]
+                last_year = shift_period(latest, time_period, PERIODS_PER_YEAR[time_period])
+                yield 'price_volume_mix', {'time_period': time_period, 'selection': selection}, timed(
+                    lambda: price_volume_mix(cube, time_period, last_year, latest, channels, divisions), repeat)
+
+def run(scales, file_format, repeat, results_file):
+    run_info = {'run_id': dt.datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                'python': sys.version.split()[0], 'pandas': pd.__version__}
+    print(f'{"scale":>6} {"benchmark":<22} {"params":<70} {"best s":>9} {"median s":>9}')
+    with open(results_file, 'a') as f:
+        for scale in scales:
+            for benchmark, params, timing in run_suite(scale, file_format, repeat):
+                record = {**run_info, 'scale': scale, 'format': file_format, 'benchmark': benchmark,
+                          'params': params, **timing}
+                f.write(json.dumps(record) + '\n')
+                print(f'{scale:>6} {benchmark:<22} {json.dumps(params):<70} '
+                      f'{timing["best_s"]:>9.4f} {timing["median_s"]:>9.4f}')
+
+#%% Comparing runs
+def compare(results_file, baseline=None, candidate=None):
+    """Best-time ratio candidate / baseline for every benchmark both runs measured"""
+    results = pd.read_json(results_file, lines=True)
+    results['params'] = results['params'].map(lambda p: json.dumps(p, sort_keys=True))
+    run_ids = sorted(results['run_id'].unique())
+    candidate = candidate or run_ids[-1]
+    baseline = baseline or run_ids[-2]
+
+    keys = ['scale', 'format', 'benchmark', 'params']
+    table = results[results['run_id'] == baseline].merge(
+        results[results['run_id'] == candidate], on=keys, suffixes=('_baseline', '_candidate'))
+    table['ratio'] = table['best_s_candidate'] / table['best_s_baseline']
+    print(f'baseline {baseline} ({table["commit_baseline"].iat[0]}) -> '
+          f'candidate {candidate} ({table["commit_candidate"].iat[0]})')
+    print(table[keys + ['best_s_baseline', 'best_s_candidate', 'ratio']].to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark cleaning and dashboard query paths')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100], help='e.g. 10 100 1000')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv', help='Format of the synthetic exports')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--results', type=Path, default=RESULTS_FILE)
+    parser.add_argument('--compare', nargs='*', metavar='RUN_ID',
+                        help='Compare two recorded runs (default: the latest two) instead of running')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.results, *args.compare)
+    else:
+        run(args.scales, args.format, args.repeat, args.results)
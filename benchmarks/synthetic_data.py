@@ -0,0 +1,127 @@
+# %%
+"""Synthetic workbooks shaped like 'Sales Report by Month Raw Data.xlsx'
+
+Same columns and layout as the real export: Month/Channel/Region only on the
+first row of their block, 'Total' subtotal rows, dash placeholders for zeros
+and the messy label variants label_mappings.csv has to fix.
+    python benchmarks/synthetic_data.py --scale 10 --format csv
+"""
+import argparse
+import math
+import numpy as np
+import openpyxl
+import pandas as pd
+from pathlib import Path
+
+COLUMNS = ['Month', 'Distribution channel', 'Region', 'Division', 'Type of product', 'Total volume ',
+           'Free of charge (Volume)', 'Sales return volume ', 'Actual sales volume', 'Sales amount \n(exclude  VAT)']
+
+CHANNELS = ['Channel GT', 'Channel MT', 'Khách lẻ', 'Others', 'ECOM']
+REGIONS = ['North', 'South', 'Middle']
+
+# Division label variants -> product label variants, as they appear in the real exports
+PRODUCTS = {
+    ('CAC', ' CAC'): ['Others'],
+    ('RAC', ' RAC'): ['Inverter', 'Non Inverter', 'Non inverter'],
+    ('Washing Machine', 'Washing machine', 'Washing machine '): ['Front load', 'Top load', 'Dryer', 'Dryer machine ',
+                                                                 'Air vented dryer, 7KG, non-inverter'],
+    ('Tivi', 'Television', 'Television '): ['Small Size', 'Small size', 'Large Size', 'Large sie'],
+    ('Refrigerator',): ['Multi door', 'Multil door ', 'Side by Side', 'Refrigerator, Side by Side', 'Top freezer',
+                        'Bottom freezer', 'Mini'],
+    ('Others', 'Other', 'Others - SDA', 'Others - SHA'): ['Rice Cooker', 'Electric cooker', 'Induction rice cooker',
+                                                          'Induction Headting ', 'Direct Water Heater', 'Water Purifier',
+                                                          'Electric Fan', 'Air Purifier'],
+}
+
+BASE_MONTHS = 18 # History held by the current workbook
+MAX_MONTHS = 240 # Beyond this, scale out with extra regions instead of more history
+DIVISION_GAP_RATE = 0.4 # Not every division sells in every channel/region each month
+DASH = ' -   '
+
+#%%
+def synthetic_regions(scale):
+    """Regions of a synthetic export - copies such as 'North 2' once the history is capped at MAX_MONTHS"""
+    n_months = min(BASE_MONTHS * scale, MAX_MONTHS)
+    n_region_sets = math.ceil(BASE_MONTHS * scale / n_months)
+    return [region if copy == 0 else f'{region} {copy + 1}' for copy in range(n_region_sets) for region in REGIONS]
+
+def generate_raw(scale=1, seed=0):
+    """Raw export DataFrame about `scale` times the size of the current workbook"""
+    rng = np.random.default_rng(seed)
+    n_months = min(BASE_MONTHS * scale, MAX_MONTHS)
+    regions = synthetic_regions(scale)
+    months = pd.date_range(end='2025-06-01', periods=n_months, freq='MS')
+
+    rows = []
+    for month in months:
+        first_in_month = True
+        for channel in CHANNELS:
+            first_in_channel = True
+            for region in regions:
+                first_in_region = True
+                for divisions, products in PRODUCTS.items():
+                    if rng.random() < DIVISION_GAP_RATE:
+                        continue
+                    division = divisions[rng.integers(len(divisions))]
+                    chosen = rng.choice(products, size=min(len(products), rng.integers(1, 3)), replace=False)
+                    for i, product in enumerate(chosen):
+                        rows.append([month if first_in_month else None,
+                                     channel if first_in_channel else None,
+                                     region if first_in_region else None,
+                                     division if i == 0 else None,
+                                     product])
+                        first_in_month = first_in_channel = first_in_region = False
+                    rows.append([None, None, None, f'{division.strip()} Total', None])
+                rows.append([None, None, f'{region} Total', None, None])
+            rows.append([None, f'{channel} Total', None, None, None])
+        rows.append([None, 'Grand Total', None, None, None])
+
+    df = pd.DataFrame(rows, columns=COLUMNS[:5])
+    n = len(df)
+    total = rng.integers(0, 5000, n)
+    free = (total * rng.uniform(0, 0.2, n)).astype(int)
+    returned = (total * rng.uniform(0, 0.05, n)).astype(int)
+    actual = total - free - returned
+    amount = (actual * rng.uniform(2e6, 15e6, n)).round()
+
+    # Zeros are exported as dash placeholders in the text-formatted columns
+    for column, values in zip(COLUMNS[5:], [total, free, returned, actual, amount]):
+        values = pd.Series(values, dtype='object')
+        if column != 'Total volume ':
+            values[values == 0] = DASH
+        df[column] = values
+    return df
+
+def write_raw(df, path):
+    """Write as csv, or as xlsx through a write-only (streaming) openpyxl workbook"""
+    path = Path(path)
+    if path.suffix == '.csv':
+        df.to_csv(path, index=False)
+        return path
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(COLUMNS)
+    for row in df.itertuples(index=False):
+        sheet.append([None if isinstance(value, float) and math.isnan(value) else value for value in row])
+    workbook.save(path)
+    return path
+
+def synthetic_workbook(scale, directory, file_format='csv', seed=0):
+    """Path of a synthetic export at the given scale, generated on first use"""
+    path = Path(directory) / f'synthetic_x{scale}.{file_format}'
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_raw(generate_raw(scale, seed), path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic raw sales export')
+    parser.add_argument('--scale', type=int, default=10, help='Size relative to the current workbook')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--output-dir', type=Path, default=Path(__file__).parent / 'data')
+    args = parser.parse_args()
+
+    path = synthetic_workbook(args.scale, args.output_dir, args.format)
+    print(f'Wrote {path}')
@@ -0,0 +1,78 @@
+# %%
+import numpy as np
+import pandas as pd
+from aggregates import ALL, DIMENSIONS
+from profiling import stage
+
+# Price-volume-mix bridge of Sales amount between two periods. Segments are the finest cube
+# series (one value in every dimension); price is Sales amount / Actual sales volume.
+#   Volume  change of total volume at the base period's average price
+#   Mix     one step per dimension, in DIMENSIONS order: the shift of volume between the
+#           values of that dimension within the levels before it, at base-period prices
+#   Price   price change of every segment, at current-period volume
+#   New / discontinued  segments without volume in one of the two periods
+# The steps add up exactly to the change in Sales amount.
+MIX_STEPS = [f'{dimension} mix' for dimension in DIMENSIONS]
+BRIDGE_STEPS = ['Volume'] + MIX_STEPS + ['Price', 'New / discontinued']
+
+#%%
+def _segments(cube, time_period, base, current, selections):
+    """(segment codes per dimension, sales and volume as 2 x segment arrays - row 0 base, row 1 current)"""
+    table = cube[time_period]
+    keys = []
+    for level, selected in enumerate(selections):
+        values = [value for value in table.index.levels[level] if value != ALL]
+        keys.append(values if ALL in selected else [value for value in selected if value in set(values)])
+    keys.append([period for period in dict.fromkeys([base, current]) if period in table.index.levels[-1]])
+    try:
+        rows = table.iloc[table.index.get_locs(keys)] if all(keys) else table.iloc[:0]
+    except KeyError: # None of the selected series has data in either period
+        rows = table.iloc[:0]
+
+    index = rows.index
+    sizes = [len(level) for level in index.levels[:len(DIMENSIONS)]]
+    segments, segment_codes = np.unique(np.ravel_multi_index(index.codes[:len(DIMENSIONS)], sizes), return_inverse=True)
+    period_row = (index.get_level_values(-1) == current).astype(int) if base != current else np.zeros(len(rows), dtype=int)
+    sales, volume = np.zeros((2, len(segments))), np.zeros((2, len(segments)))
+    sales[period_row, segment_codes] = rows['Sales amount'].to_numpy()
+    volume[period_row, segment_codes] = rows['Actual sales volume'].to_numpy()
+    if base == current:
+        sales[1], volume[1] = sales[0], volume[0]
+    return np.unravel_index(segments, sizes), sizes, sales, volume
+
+@stage('price_volume_mix')
+def price_volume_mix(cube, time_period, base, current, channels=(ALL,), divisions=(ALL,), regions=(ALL,), products=(ALL,)):
+    """Sales amount bridge from the base to the current period for a selection
+
+    'ALL' in a selection mixes every value of that dimension; specific values restrict
+    the bridge to them. Returns one row per step - 'Base', the BRIDGE_STEPS, 'Current' -
+    with the Sales amount and the plotly waterfall 'Kind' of the step.
+    """
+    codes, sizes, sales, volume = _segments(cube, time_period, base, current, (channels, regions, divisions, products))
+    continuing = (volume > 0).all(axis=0) # Segments with a price in both periods
+    sales_c, volume_c = sales[:, continuing], volume[:, continuing]
+    base_volume, current_volume = volume_c.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_price = sales_c[0].sum() / base_volume if base_volume else 0.0
+
+        # Current volume at base prices, grouping the segments by ever more dimensions:
+        # the total, then by channel, by channel x region, ... up to every segment
+        at_base_prices = [current_volume * average_price]
+        for depth in range(1, len(DIMENSIONS) + 1):
+            groups = np.ravel_multi_index([code[continuing] for code in codes[:depth]], sizes[:depth])
+            _, group_codes = np.unique(groups, return_inverse=True)
+            group_sales = np.bincount(group_codes, sales_c[0])
+            group_volume = np.bincount(group_codes, volume_c[0])
+            at_base_prices.append(np.bincount(group_codes, volume_c[1]) @ (group_sales / group_volume) if len(groups) else 0.0)
+
+    steps = {
+        'Volume': (current_volume - base_volume) * average_price,
+        **{step: at_base_prices[depth + 1] - at_base_prices[depth] for depth, step in enumerate(MIX_STEPS)},
+        'Price': sales_c[1].sum() - at_base_prices[-1],
+        'New / discontinued': sales[1, ~continuing].sum() - sales[0, ~continuing].sum(),
+    }
+    return pd.DataFrame({
+        'Step': ['Base'] + list(steps) + ['Current'],
+        'Kind': ['absolute'] + ['relative'] * len(steps) + ['total'],
+        'Sales amount': [sales[0].sum()] + [float(value) for value in steps.values()] + [sales[1].sum()],
+    })
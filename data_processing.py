@@ -1,79 +1,654 @@
 # %%
+import argparse
+import csv
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import openpyxl
 import pandas as pd
 from pathlib import Path
+from profiling import stage, stage_table
+
+try:
+    from python_calamine import CalamineWorkbook # Optional, much faster xlsx reader
+except ImportError:
+    CalamineWorkbook = None
+
+# Use relative path - looks for files in the same directory as this script
+current_dir = Path(__file__).parent
+RAW_DATA_FILE = current_dir / 'Sales Report by Month Raw Data.xlsx'
+CLEANED_CSV_FILE = current_dir / 'Sales Data_cleaned.csv'
+
+# Persistent cache of the cleaned data, keyed on the source workbook fingerprint
+CACHE_DIR = current_dir / '.cache'
+CACHE_DATA_FILE = CACHE_DIR / 'cleaned_data.parquet'
+CACHE_META_FILE = CACHE_DIR / 'cleaned_data.json'
+
+# Directory of additional monthly/yearly exports, and the cleaned month partitions of all sources
+RAW_DATA_DIR = current_dir / 'raw_exports'
+PARTITIONS_DIR = CACHE_DIR / 'partitions'
+PARTITIONS_MANIFEST_FILE = PARTITIONS_DIR / 'manifest.json'
+# Partition files are never overwritten: each dataset version lists its own files here, and the
+# files of the last KEEP_VERSIONS versions are kept so a snapshot still being served can read them
+PARTITION_VERSIONS_DIR = PARTITIONS_DIR / 'versions'
+KEEP_VERSIONS = 2
+
+# Category dictionary of every dimension - labels are only ever appended, so codes stay stable
+CATEGORIES_FILE = CACHE_DIR / 'categories.json'
+
+DIMENSION_COLUMNS = ['Distribution channel', 'Region', 'Division', 'Type of product']
+
+# Raw -> canonical label fixes per dimension, editable without touching code
+LABEL_MAPPINGS_FILE = current_dir / 'label_mappings.csv'
+
+# Accepted labels per dimension - anything else that is not mapped by label_mappings.csv fails validation
+KNOWN_LABELS_FILE = current_dir / 'known_labels.csv'
+
+# What each data-quality check does when it finds rows: 'error' fails the load before anything
+# is written or cached, 'warning' is only reported (see validate_cleaned)
+VALIDATION_SEVERITY = {
+    'unknown_label': 'error',
+    'non_numeric_measure': 'error',
+    'duplicate_key': 'warning', # The current workbook repeats its January 2025 block
+    'negative_volume': 'warning',
+    'actual_exceeds_total': 'warning',
+    'filled_across_groups': 'warning',
+}
+HIERARCHY_COLUMNS = ['Month'] + DIMENSION_COLUMNS # Blank cells are filled from the row above, level by level
+GROSS_VOLUME_COLUMNS = ['Total volume', 'Free of charge (Volume)', 'Sales return volume']
+
+validation_logger = logging.getLogger('casper.validation')
+
+# Measures the dashboard never reads - dropped by compact_dataset
+COMPACT_DROPPED_COLUMNS = ['Free of charge (Volume)', 'Sales return volume']
+
+#%% Label normalization
+def load_label_mappings(path=LABEL_MAPPINGS_FILE):
+    """Read the raw -> canonical label table as {dimension: {raw: canonical}}
+
+    Chains such as 'Induction Headting' -> 'Induction Heating' -> 'Water Heater'
+    are resolved to their final label so each value is mapped in a single pass.
+    """
+    table = pd.read_csv(path, dtype='string')
+    mappings = {}
+    for dimension, rows in table.groupby('dimension'):
+        mapping = dict(zip(rows['raw_label'].str.strip(), rows['canonical_label'].str.strip()))
+        for raw_label in mapping:
+            seen = {raw_label}
+            while mapping[raw_label] in mapping and mapping[raw_label] not in seen:
+                seen.add(mapping[raw_label])
+                mapping[raw_label] = mapping[mapping[raw_label]]
+        mappings[dimension] = mapping
+    return mappings
+
+def normalize_labels(values, mapping, categories):
+    """Strip and map a dimension column by working on its categories instead of every row
+
+    Returns a categorical on the given (stable) category list, extending it with
+    any label not seen before.
+    """
+    values = values.astype('category')
+    canonical = values.cat.categories.astype('string').str.strip().to_series().replace(mapping)
+    categories.extend(label for label in canonical.unique() if label not in categories)
+    code_map = pd.Index(categories).get_indexer(canonical)
+    codes = values.cat.codes.to_numpy()
+    codes = pd.Series(code_map).take(codes).where(codes >= 0, -1).to_numpy() if len(code_map) else codes
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=values.index)
+
+#%% Category dictionary
+def load_category_dictionary():
+    """Persisted {dimension: [labels]} - position in the list is the category code"""
+    try:
+        categories = json.loads(CATEGORIES_FILE.read_text())
+    except (OSError, ValueError):
+        categories = {}
+    return {column: categories.get(column, []) for column in DIMENSION_COLUMNS}
+
+def save_category_dictionary(categories):
+    CACHE_DIR.mkdir(exist_ok=True)
+    CATEGORIES_FILE.write_text(json.dumps(categories, ensure_ascii=False, indent=1))
+
+def apply_category_dictionary(df, categories):
+    """Put every dimension column on the shared categorical dtype (e.g. after a concat)
+
+    Labels of df missing from the dictionary (e.g. after categories.json was deleted or
+    corrupted) are appended and saved, rather than turned into NaN.
+    """
+    extended = False
+    for column in DIMENSION_COLUMNS:
+        values = df[column]
+        labels = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else values.dropna().unique()
+        known = set(categories[column])
+        missing = [label for label in labels if label not in known]
+        if missing:
+            categories[column] = categories[column] + missing
+            extended = True
+    if extended:
+        save_category_dictionary(categories)
+    return df.astype({column: pd.CategoricalDtype(categories[column]) for column in DIMENSION_COLUMNS})
+
+def compact_dataset(df):
+    """Dashboard-sized version of the cleaned data: float32 measures and the unused measures dropped
+
+    float32 keeps volumes exact up to 16.7M units per row and Sales amount (billion VND)
+    to about 7 significant digits, far finer than the dashboard displays.
+    """
+    df = df.drop(columns=COMPACT_DROPPED_COLUMNS, errors='ignore')
+    measures = [column for column in df.columns if column != 'Month' and column not in DIMENSION_COLUMNS]
+    return df.astype(dict.fromkeys(measures, 'float32'))
+
+def _to_measure(values):
+    """Convert a measure column to float64, reading dash-only placeholder cells as 0
+
+    Returns (numbers, text of the cells that are not numbers) - those cells are left NaN.
+    """
+    numbers = pd.to_numeric(values, errors='coerce')
+    unparsed = numbers.isna() & values.notna()
+    bad_text = values.iloc[:0].astype('string')
+    if unparsed.any():
+        text = values[unparsed].astype('string').str.strip()
+        dashes = text.str.fullmatch('-+')
+        numbers[unparsed & dashes.reindex(values.index, fill_value=False)] = 0
+        bad_text = text[~dashes]
+    return numbers.astype('float64'), bad_text
+
+#%% Raw workbook reading
+def _iter_sheet_rows(path, engine):
+    """Cell values of the first sheet, row by row, without building the workbook object model"""
+    if Path(path).suffix.lower() == '.csv': # Same layout exported as csv
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.reader(f)
+    elif engine == 'calamine':
+        workbook = CalamineWorkbook.from_path(str(path))
+        yield from workbook.get_sheet_by_index(0).iter_rows()
+    else:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+def read_raw_workbook(path=RAW_DATA_FILE, engine=None):
+    """Stream the raw export (xlsx or csv), dropping 'Total' subtotal rows and forward-filling blanks on the fly
+
+    engine: 'calamine' (used by default when python-calamine is installed),
+    'openpyxl' (read-only mode) or 'pandas' for the plain pd.read_excel path.
+    Row labels are the data row positions in the sheet, same as pd.read_excel.
+    """
+    if engine is None:
+        engine = 'calamine' if CalamineWorkbook is not None else 'openpyxl'
+    with stage(f'read_raw_workbook[{engine}]') as record:
+        df = _read_rows(path, engine)
+        record['rows_out'] = len(df)
+    return df
+
+def _read_rows(path, engine):
+    if engine == 'pandas':
+        return pd.read_csv(path) if Path(path).suffix.lower() == '.csv' else pd.read_excel(path)
+
+    rows = _iter_sheet_rows(path, engine)
+    header = list(next(rows))
+    subtotal_columns = [header.index(column) for column in ('Distribution channel', 'Region', 'Division')]
+    hierarchy_columns = [header.index(column) for column in HIERARCHY_COLUMNS]
+    month_column = header.index('Month')
+    last = [None] * len(header)
+    kept, positions, filled_across = [], [], []
+    for position, row in enumerate(rows):
+        values = [None if value == '' else value for value in row]
+        if any(isinstance(values[i], str) and 'total' in values[i].lower() for i in subtotal_columns):
+            continue # Subtotal row
+        present = [values[i] is not None for i in hierarchy_columns]
+        if True not in present or False in present[present.index(True):]:
+            filled_across.append(position) # A new group starts here but a lower level is blank
+        if type(values[month_column]) is dt.date: # calamine returns date-only cells as dates
+            values[month_column] = dt.datetime.combine(values[month_column], dt.time())
+        last = [previous if value is None else value for value, previous in zip(values, last)]
+        kept.append(last)
+        positions.append(position)
+
+    df = pd.DataFrame(kept, columns=header, index=positions)
+    df.attrs['filled_across_groups'] = filled_across # Read by the validation in clean_data
+    return df
 
 #%%
-def load_and_clean_data():
-    """Load raw data and perform all cleaning operations"""
-    # Use relative path - looks for file in the same directory as this script
-    current_dir = Path(__file__).parent
-    df = pd.read_excel(current_dir / 'Sales Report by Month Raw Data.xlsx')
+def clean_data(df, streamed=False):
+    """Perform all cleaning operations on the raw workbook data
+
+    streamed=True means subtotal rows were already dropped and blanks filled by read_raw_workbook.
+    """
+    with stage('clean_data', rows_in=len(df)) as record:
+        df = _clean_rows(df, streamed)
+        record['rows_out'] = len(df)
+    return df
+
+def _clean_rows(df, streamed):
     df.Month = pd.to_datetime(df.Month) # Make sure it's in date time format
     
-    # Cleaning up data and files
-    df = df[(~df['Distribution channel'].str.contains('total', case=False, na=False)) &
-            (~df['Region'].str.contains('total', case=False, na=False)) &
-            (~df['Division'].str.contains('total', case=False, na=False))
-            ] # Delete all rows with 'Total' in the name (~ means exclusion)
-    
-    df = df.ffill() # Front fill all the empty rows
+    if streamed:
+        filled_across = df.index.isin(df.attrs.get('filled_across_groups', []))
+    else:
+        # Cleaning up data and files
+        with stage('drop_subtotals', rows_in=len(df)) as record:
+            df = df[(~df['Distribution channel'].str.contains('total', case=False, na=False)) &
+                    (~df['Region'].str.contains('total', case=False, na=False)) &
+                    (~df['Division'].str.contains('total', case=False, na=False))
+                    ] # Delete all rows with 'Total' in the name (~ means exclusion)
+            record['rows_out'] = len(df)
+        
+        # Rows that start a new group but leave a lower level blank (ffill would carry it over from the previous group)
+        blank = df[HIERARCHY_COLUMNS].isna().to_numpy()
+        started = np.logical_or.accumulate(~blank, axis=1)
+        filled_across = (blank & started).any(axis=1) | blank.all(axis=1)
+        
+        with stage('ffill', rows_in=len(df)):
+            df = df.ffill() # Front fill all the empty rows
     
     # Fix columns names
     df.rename(columns={'Sales amount \n(exclude  VAT)': 'Sales amount'}, inplace=True) # Rename for easier access
     col = df.columns.str.strip() # Strip blank spaces in column names
     df.columns = col # Apply the stripped names
     
-    # Strip blank spaces before and after 
-    for column in col[1:]:
-        df[column] = df[column].astype('string')
-        df[column] = df[column].str.strip()
-        df[column] = df[column].replace({'^-+$': '0'}, regex=True) #change "-" thành 0
+    duplicated = df.duplicated(subset=HIERARCHY_COLUMNS) # On the raw labels, before aliases are merged
     
-    for column in col[5:]: #shift back into ints for key numbers
-       df[column] = df[column].astype('float64')   
+    # Strip blank spaces and map label aliases to canonical names (see label_mappings.csv)
+    with stage('normalize_labels', rows_in=len(df)):
+        mappings = load_label_mappings()
+        categories = load_category_dictionary()
+        for column in DIMENSION_COLUMNS:
+            df[column] = normalize_labels(df[column], mappings.get(column, {}), categories[column])
     
-    # Chia sales amount về tr
-    df['Sales amount'] = df['Sales amount'] / (10**9)
-        
-    # Edit product types and divisions
-    df['Division'] = df['Division'].replace({'Other': 'Others'}) # Fix 'Others' and 'Other'
-    df['Division'] = df['Division'].replace({'Washing machine': 'Washing Machine'}) # Fix 'Washing Machine' 
-    df['Division'] = df['Division'].replace({'Tivi' : 'Television'}) # Fix 'Television'
-    
-    # Edit product types
-    df['Type of product'] = df['Type of product'].replace({'Small Size' : 'Small size', 'Large Size' : 'Large size', 'Large sie' : 'Large size'}) #fixed TV
-    df['Type of product'] = df['Type of product'].replace({'Multi door' : 'Multi doors', 'Multil door' : 'Multi doors', 'Refrigerator, Side by Side' : 'Side by Side'}) #fixed fridge
-    df['Type of product'] = df['Type of product'].replace({'Air vented dryer, 7KG, non-inverter' : 'Dryer Machine', 'Dryer' : 'Dryer Machine'}) # fixed WM+
-    # All types of heater + fan + purifier 
-    df['Type of product'] = df['Type of product'].replace({'Water Purifier' : 'Water purifier'}) 
-    df['Type of product'] = df['Type of product'].replace({'Electric Fan' : 'Electric fan'}) 
-    df['Type of product'] = df['Type of product'].replace({'Air Purifier' : 'Air purifier'}) 
-    df['Type of product'] = df['Type of product'].replace({'Induction Headting' : 'Induction Heating'}) 
-    df['Type of product'] = df['Type of product'].replace({'Direct Water Heater' : 'Water Heater'}) 
-    df['Type of product'] = df['Type of product'].replace({'Indirect Water Heater' : 'Water Heater'}) 
-    df['Type of product'] = df['Type of product'].replace({'Induction Heating' : 'Water Heater'}) 
-    # All type of cookers turn into just Cooker
-    df['Type of product'] = df['Type of product'].replace({'Rice Cooker' : 'Cooker'}) 
-    df['Type of product'] = df['Type of product'].replace({'Electric rice cooker' : 'Cooker'}) 
-    df['Type of product'] = df['Type of product'].replace({'Induction cooker' : 'Cooker'}) 
-    df['Type of product'] = df['Type of product'].replace({'Electric cooker' : 'Cooker'}) 
-    df['Type of product'] = df['Type of product'].replace({'Induction rice cooker' : 'Cooker'}) 
+    with stage('parse_measures', rows_in=len(df)):
+        non_numeric = {}
+        for column in col[5:]: #shift back into numbers for key measures
+            df[column], non_numeric[column] = _to_measure(df[column])
     
-    # Edit channel names (post 2025 changes)
-    df['Distribution channel'] = df['Distribution channel'].replace({'Channel GT' : 'GT', 'Channel MT' : 'MT', 'Khách lẻ' : 'Retail', 'Others' : 'Others', 'ECOM' : 'ECOM'})
+    # Fails here on errors, before the category dictionary, csv or cache are written
+    validate_cleaned(df, non_numeric, duplicated, filled_across, mappings)
+    save_category_dictionary(categories)
     
-    # Merge some other divisions
-    df['Division'] = df['Division'].replace({'Others - SDA': 'Others', 'Others - SHA': 'Others'})
+    # Chia sales amount về tr
+    df['Sales amount'] = df['Sales amount'] / (10**9)
+
+    return df
+
+#%% Validation
+class DataValidationError(ValueError):
+    """A load failed one or more 'error' checks - .issues holds the full report"""
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__('Data validation failed:\n' + format_issues(issues))
+
+def load_known_labels(path=KNOWN_LABELS_FILE, mappings=None):
+    """{dimension: set of accepted labels} - known_labels.csv plus every canonical label of the mappings"""
+    known = {column: set() for column in DIMENSION_COLUMNS}
+    if path.exists():
+        table = pd.read_csv(path, dtype='string')
+        for dimension, labels in table.groupby('dimension'):
+            known[dimension].update(labels['label'].str.strip())
+    for dimension, mapping in (mappings or {}).items():
+        known[dimension].update(mapping.values())
+    return known
+
+def _issue(check, count, detail, sample):
+    return {'check': check, 'severity': VALIDATION_SEVERITY[check], 'rows': int(count), 'detail': detail, 'sample': sample[:5]}
+
+def validate_cleaned(df, non_numeric, duplicated, filled_across, mappings):
+    """Vectorized data-quality checks on freshly cleaned rows
+
+    non_numeric: {measure: text of unparseable cells}, duplicated/filled_across: row masks
+    from before the labels were merged / the blanks filled. Logs warnings, raises
+    DataValidationError if any check whose VALIDATION_SEVERITY is 'error' finds rows.
+    """
+    with stage('validate', rows_in=len(df)):
+        issues = []
+        known = load_known_labels(KNOWN_LABELS_FILE, mappings)
+        for column in DIMENSION_COLUMNS:
+            if not known[column]:
+                continue # No reference list for this dimension
+            counts = df[column].value_counts()
+            unknown = counts[(counts > 0) & ~counts.index.isin(list(known[column]))]
+            if len(unknown):
+                issues.append(_issue('unknown_label', unknown.sum(), column, [f'{label} ({n})' for label, n in unknown.items()]))
+        for column, text in non_numeric.items():
+            if len(text):
+                issues.append(_issue('non_numeric_measure', len(text), column, text.unique().tolist()))
+        if duplicated.any():
+            keys = df.loc[duplicated, HIERARCHY_COLUMNS].astype(str).agg(' / '.join, axis=1)
+            issues.append(_issue('duplicate_key', duplicated.sum(), 'same month and dimensions', keys.unique().tolist()))
+        for column in GROSS_VOLUME_COLUMNS:
+            negative = df[column] < 0
+            if negative.any():
+                issues.append(_issue('negative_volume', negative.sum(), column, df.index[negative].tolist()))
+        exceeds = df['Actual sales volume'] > df['Total volume']
+        if exceeds.any():
+            issues.append(_issue('actual_exceeds_total', exceeds.sum(), 'Actual sales volume > Total volume', df.index[exceeds].tolist()))
+        if filled_across.any():
+            issues.append(_issue('filled_across_groups', filled_across.sum(), 'blank lower level at the start of a group',
+                                 df.index[filled_across].tolist()))
+
+    errors = [issue for issue in issues if issue['severity'] == 'error']
+    if errors:
+        raise DataValidationError(issues)
+    if issues:
+        validation_logger.warning('Data validation warnings:\n%s', format_issues(issues))
+    return issues
+
+def format_issues(issues):
+    """One line per issue: severity, check, row count, what and a few examples (row labels or values)"""
+    return '\n'.join(f"{issue['severity']:<8}{issue['check']:<22}{issue['rows']:>7} rows  {issue['detail']}: "
+                     f"{', '.join(map(str, issue['sample']))}" for issue in issues)
+
+#%% Cleaned data cache
+def _sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def source_fingerprint(path=RAW_DATA_FILE):
+    """Size, mtime and SHA-256 content hash of the source workbook"""
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _sha256(path)}
+
+def _read_cache_meta():
+    try:
+        return json.loads(CACHE_META_FILE.read_text())
+    except (OSError, ValueError):
+        return None
+
+def _cache_is_valid(path):
+    """Check the cached fingerprint against the workbook (hash only when size/mtime changed)"""
+    meta = _read_cache_meta()
+    if meta is None or not CACHE_DATA_FILE.exists():
+        return False
+    if meta.get('mappings_sha256') != _sha256(LABEL_MAPPINGS_FILE):
+        return False # Label fixes changed, cached labels are stale
+    stat = path.stat()
+    if meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    # Touched but maybe not modified - compare content hash and refresh the stored mtime
+    fingerprint = source_fingerprint(path)
+    if meta['sha256'] != fingerprint['sha256']:
+        return False
+    meta.update(fingerprint)
+    CACHE_META_FILE.write_text(json.dumps(meta))
+    return True
+
+def _write_cache(df, fingerprint, month_hashes):
+    """Store the cleaned data as Parquet (dimensions dictionary-encoded as category codes)"""
+    CACHE_DIR.mkdir(exist_ok=True)
+    tmp_file = CACHE_DATA_FILE.with_suffix('.parquet.tmp')
+    with stage('write_cache', rows_in=len(df)):
+        df.to_parquet(tmp_file)
+    tmp_file.replace(CACHE_DATA_FILE) # Swap in atomically so readers never see a partial file
+    CACHE_META_FILE.write_text(json.dumps({**fingerprint, 'month_hashes': month_hashes}))
+
+def _read_cache():
+    with stage('read_cache') as record:
+        df = apply_category_dictionary(pd.read_parquet(CACHE_DATA_FILE), load_category_dictionary())
+        record['rows_out'] = len(df)
+    return df
+
+def invalidate_cache():
+    """Drop the cached cleaned data so the next load re-parses the workbook"""
+    for path in (CACHE_DATA_FILE, CACHE_META_FILE):
+        path.unlink(missing_ok=True)
+
+def rebuild_cache():
+    """Force a full re-parse of the workbook and rewrite the cache"""
+    invalidate_cache()
+    return load_and_clean_data()
+
+#%% Incremental ingestion
+def _raw_months(raw):
+    """Month of every raw row (the workbook only fills Month on the first row of each block)"""
+    return pd.to_datetime(raw['Month']).ffill().dt.strftime('%Y-%m')
+
+def month_hashes(raw, months):
+    """Hash of the raw rows of each month, used to detect new or edited months
+
+    Row positions are part of the hash, so rows shifted by an insert earlier in the
+    workbook count as changed and keep the same labels as a full rebuild.
+    """
+    row_hashes = pd.util.hash_pandas_object(raw.astype('string'), index=True)
+    return {month: format(int(hashes.sum()), 'x') for month, hashes in row_hashes.groupby(months.to_numpy())}
+
+def _ingest_incremental(raw, months, hashes, streamed):
+    """Clean only new/changed months and merge them into the cached snapshot (None = needs full rebuild)"""
+    meta = _read_cache_meta()
+    if meta is None or 'month_hashes' not in meta or not CACHE_DATA_FILE.exists():
+        return None
+    if meta.get('mappings_sha256') != _sha256(LABEL_MAPPINGS_FILE):
+        return None
+
+    old_hashes = meta['month_hashes']
+    changed = [month for month, digest in hashes.items() if old_hashes.get(month) != digest]
+    removed = [month for month in old_hashes if month not in hashes]
+    if not changed and not removed:
+        return _read_cache()
+    new_rows = raw[months.isin(changed)]
+
+    # Each month block must start with its own dimensions, otherwise ffill would depend on earlier months
+    block_starts = new_rows[~months[new_rows.index].duplicated()]
+    if block_starts[DIMENSION_COLUMNS].isna().any().any():
+        return None
+
+    cached = _read_cache()
+    kept = cached[~cached['Month'].dt.strftime('%Y-%m').isin(changed + removed)]
+    cleaned = clean_data(new_rows.copy(), streamed)
+    df = pd.concat([kept, cleaned]).sort_index() # Row labels are workbook positions, same as a full rebuild
+    df = apply_category_dictionary(df, load_category_dictionary())
+
+    # Rows appended at the end of the workbook only need to be added to the csv
+    if not removed and cleaned.index.min() > kept.index.max() and CLEANED_CSV_FILE.exists():
+        with stage('append_csv', rows_in=len(cleaned)):
+            cleaned.to_csv(CLEANED_CSV_FILE, mode='a', header=False, index=False)
+    else:
+        with stage('write_csv', rows_in=len(df)):
+            df.to_csv(CLEANED_CSV_FILE, index=False)
 
-    # Save as csv for safety
-    df.to_csv(current_dir / 'Sales Data_cleaned.csv', index=False)
-    
+    return df
+
+#%%
+def load_and_clean_data(use_cache=True, incremental=True, engine=None):
+    """Load raw data and perform all cleaning operations (served from cache when the workbook is unchanged)
+
+    With incremental=True only the months that are new or changed since the cached
+    snapshot are cleaned and merged in, instead of reprocessing the whole history.
+    engine selects the workbook reader, see read_raw_workbook.
+    """
+    with stage('load_and_clean_data') as record:
+        df = _load_and_clean(use_cache, incremental, engine)
+        record['rows_out'] = len(df)
+    return df
+
+def _load_and_clean(use_cache, incremental, engine):
+    if use_cache and _cache_is_valid(RAW_DATA_FILE):
+        return _read_cache()
+
+    fingerprint = {**source_fingerprint(RAW_DATA_FILE), 'mappings_sha256': _sha256(LABEL_MAPPINGS_FILE)}
+    raw = read_raw_workbook(RAW_DATA_FILE, engine)
+    streamed = engine != 'pandas'
+    with stage('month_hashes', rows_in=len(raw)):
+        months = _raw_months(raw)
+        hashes = month_hashes(raw, months)
+
+    df = _ingest_incremental(raw, months, hashes, streamed) if use_cache and incremental else None
+    if df is None:
+        df = clean_data(raw, streamed)
+
+        # Save as csv for safety
+        with stage('write_csv', rows_in=len(df)):
+            df.to_csv(CLEANED_CSV_FILE, index=False)
+
+    if use_cache:
+        _write_cache(df, fingerprint, hashes)
+
+    return df
+
+
+#%% Multi-file sources and month partitions
+def raw_sources(directory=RAW_DATA_DIR):
+    """The main workbook followed by every export in raw_exports/ (name order, later files win per month)"""
+    sources = [RAW_DATA_FILE] if RAW_DATA_FILE.exists() else []
+    if directory.is_dir():
+        sources += sorted(path for path in directory.iterdir()
+                          if path.suffix.lower() in ('.xlsx', '.csv') and not path.name.startswith('~$'))
+    return sources
+
+def _partition_file(month, source_sha256, mappings_sha256):
+    """Path of a month partition relative to PARTITIONS_DIR, named after the content it is cleaned from"""
+    token = hashlib.sha256(f'{source_sha256}:{mappings_sha256}'.encode()).hexdigest()[:12]
+    return f'year={month[:4]}/month={month[5:]}/part-{token}.parquet'
+
+def _clean_source(path):
+    """Cleaned rows of one export - the main workbook goes through the cached/incremental loader"""
+    if path == RAW_DATA_FILE:
+        return load_and_clean_data()
+    return clean_data(read_raw_workbook(path), streamed=True)
+
+@stage('sync_partitions')
+def sync_partitions(directory=RAW_DATA_DIR):
+    """Clean new/changed exports and rewrite only the month partitions they own
+
+    Each month is owned by the last source (in raw_sources order) that contains it,
+    so a re-exported year or a corrected month file replaces older data for those months.
+    Changed months are written to new files and the manifest is swapped in last, so
+    readers of the previous version keep reading its files. Returns the list of partition months.
+    """
+    manifest = _read_manifest()
+    mappings_sha256 = _sha256(LABEL_MAPPINGS_FILE)
+    known = manifest.get('sources', {}) if manifest.get('mappings_sha256') == mappings_sha256 else {}
+
+    # Clean only the sources whose content changed since the last sync
+    sources = raw_sources(directory)
+    cleaned, entries = {}, {}
+    for path in sources:
+        digest = _sha256(path)
+        if known.get(path.name, {}).get('sha256') == digest:
+            entries[path.name] = known[path.name]
+            continue
+        cleaned[path.name] = _clean_source(path)
+        months = cleaned[path.name]['Month'].dt.strftime('%Y-%m')
+        entries[path.name] = {'sha256': digest, 'months': sorted(months.unique())}
+
+    owners = {}
+    for path in sources:
+        owners.update({month: path.name for month in entries[path.name]['months']})
+    files = {month: _partition_file(month, entries[name]['sha256'], mappings_sha256) for month, name in owners.items()}
+
+    # A month that changes hands to an unchanged source needs that source's rows again
+    for month, name in owners.items():
+        if name not in cleaned and not (PARTITIONS_DIR / files[month]).exists():
+            cleaned[name] = _clean_source(next(path for path in sources if path.name == name))
+
+    for name, df in cleaned.items():
+        months = df['Month'].dt.strftime('%Y-%m')
+        for month, rows in df.groupby(months.to_numpy()):
+            if owners.get(month) != name:
+                continue
+            path = PARTITIONS_DIR / files[month]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = path.with_suffix('.parquet.tmp')
+            rows.reset_index(drop=True).to_parquet(tmp_file)
+            tmp_file.replace(path)
+
+    manifest = {'mappings_sha256': mappings_sha256, 'sources': entries, 'owners': owners, 'files': files}
+    PARTITION_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    for path, text in ((PARTITION_VERSIONS_DIR / f'{_manifest_version(manifest)}.json', json.dumps(files)),
+                       (PARTITIONS_MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False))):
+        tmp_file = path.with_suffix(f'.json.tmp-{os.getpid()}')
+        tmp_file.write_text(text)
+        tmp_file.replace(path) # Readers see the old or the new file, never a partial one; the manifest goes last
+    _prune_partitions(_manifest_version(manifest))
+    return sorted(owners)
+
+def _read_manifest():
+    """Current partition manifest ({} before the first sync, or for a layout without per-version files)"""
+    try:
+        manifest = json.loads(PARTITIONS_MANIFEST_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+    return manifest if 'files' in manifest else {} # Older layouts are re-synced into versioned files
+
+def _manifest_version(manifest):
+    sources = {name: entry['sha256'] for name, entry in manifest['sources'].items()}
+    return hashlib.sha256(json.dumps([manifest['mappings_sha256'], sources], sort_keys=True).encode()).hexdigest()[:12]
+
+def _prune_partitions(current):
+    """Delete partition files no longer listed by the current or the last KEEP_VERSIONS versions"""
+    versions = sorted(PARTITION_VERSIONS_DIR.glob('*.json'), key=lambda path: path.stat().st_mtime)
+    kept = set()
+    for path in versions:
+        if path.stem == current or path in versions[-KEEP_VERSIONS:]:
+            kept.update(json.loads(path.read_text()).values())
+        else:
+            path.unlink(missing_ok=True)
+    for path in PARTITIONS_DIR.glob('year=*/month=*/*.parquet'):
+        if path.relative_to(PARTITIONS_DIR).as_posix() not in kept:
+            path.unlink(missing_ok=True)
+
+def dataset_version():
+    """Short id of the current partition contents - changes whenever any source is re-synced with new data"""
+    manifest = _read_manifest()
+    return _manifest_version(manifest) if manifest else None
+
+def partition_files(version=None):
+    """{'YYYY-MM': partition path} of a dataset version (None = the current one)"""
+    if version is None:
+        files = _read_manifest().get('files', {})
+    else:
+        try:
+            files = json.loads((PARTITION_VERSIONS_DIR / f'{version}.json').read_text())
+        except OSError:
+            raise FileNotFoundError(f"The partitions of dataset version {version} are no longer stored - reload the data") from None
+    return {month: PARTITIONS_DIR / path for month, path in files.items()}
+
+def partition_months(version=None):
+    """'YYYY-MM' of every month partition of a dataset version (None = the current one), without reading any data"""
+    return sorted(partition_files(version))
+
+def read_partitions(start=None, end=None, version=None):
+    """Cleaned rows for the months start..end ('YYYY-MM', inclusive) reading only those partitions
+
+    version pins the dataset version to read (see dataset_version), so a sync running
+    meanwhile does not change the rows; None reads the current version.
+    """
+    files = partition_files(version)
+    months = [month for month in sorted(files)
+              if (start is None or month >= start) and (end is None or month <= end)]
+    if not months:
+        raise ValueError(f"No month partitions between {start} and {end} - run sync_partitions() first")
+    with stage('read_partitions') as record:
+        df = pd.concat([pd.read_parquet(files[month]) for month in months], ignore_index=True)
+        df = apply_category_dictionary(df, load_category_dictionary())
+        record['rows_out'] = len(df)
     return df
 
 
 #%% Main execution
 if __name__ == "__main__":
-    df = load_and_clean_data()
+    parser = argparse.ArgumentParser(description='Clean the raw sales workbook')
+    parser.add_argument('--rebuild', action='store_true', help='Ignore the cached cleaned data and re-parse the workbook')
+    parser.add_argument('--partitions', action='store_true', help=f"Also sync the month partitions of all exports in '{RAW_DATA_DIR.name}/'")
+    parser.add_argument('--profile', action='store_true', help='Log every pipeline stage as JSON to stderr and print a timing table')
+    args = parser.parse_args()
+    if args.profile:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        df = rebuild_cache() if args.rebuild else load_and_clean_data()
+        months = sync_partitions() if args.partitions else None
+    except DataValidationError as error:
+        parser.exit(1, f'{error}\n')
+    if months:
+        print(f"Month partitions: {len(months)} ({months[0]} to {months[-1]})")
     print("Data processing completed. Cleaned data saved to 'Sales Data_cleaned.csv'")
     print(f"Data shape: {df.shape}")
-    print(f"Date range: {df['Month'].min()} to {df['Month'].max()}")
\ No newline at end of file
+    print(f"Date range: {df['Month'].min()} to {df['Month'].max()}")
+    if args.profile:
+        print(stage_table().to_string(index=False))
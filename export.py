@@ -0,0 +1,87 @@
+# %%
+import io
+import tempfile
+import numpy as np
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from profiling import stage
+
+# Full extracts of a filtered selection, written chunk by chunk so only one chunk is ever converted at a time
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+CHUNK_ROWS = 50_000
+EXCEL_MAX_ROWS = 1_048_576 # Rows per sheet, header included - longer exports continue on a new sheet
+
+#%%
+def iter_chunks(df, positions=None, chunk_rows=CHUNK_ROWS):
+    """Consecutive row slices of df, or of the rows at the given positions (see row_index.select_rows)
+
+    An empty selection gives one empty slice, so every format still writes its header.
+    """
+    n_rows = len(df) if positions is None else len(positions)
+    if n_rows == 0:
+        yield df.iloc[:0]
+    for start in range(0, n_rows, chunk_rows):
+        if positions is None:
+            yield df.iloc[start:start + chunk_rows]
+        else:
+            yield df.iloc[positions[start:start + chunk_rows]]
+
+def _write_csv(chunks, sink):
+    text = io.TextIOWrapper(sink, encoding='utf-8', newline='', write_through=True)
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(text, header=i == 0, index=False)
+    text.detach() # Leave the underlying file open for the caller
+
+def _write_parquet(chunks, sink):
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+def _write_xlsx(chunks, sink, columns):
+    workbook = openpyxl.Workbook(write_only=True) # Rows go straight to the zip stream, no cell objects are kept
+    sheet, sheet_rows = None, EXCEL_MAX_ROWS
+    for chunk in chunks:
+        for row in chunk.itertuples(index=False, name=None):
+            if sheet_rows == EXCEL_MAX_ROWS:
+                sheet = workbook.create_sheet()
+                sheet.append(columns)
+                sheet_rows = 1
+            sheet.append([None if isinstance(value, float) and np.isnan(value) else value for value in row])
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet().append(columns)
+    workbook.save(sink)
+
+def write_export(df, sink, file_format, positions=None):
+    """Write df (or its rows at positions) as csv, parquet or xlsx to a path or binary file object"""
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{file_format}', expected one of {list(EXPORT_FORMATS)}")
+    with stage(f'export[{file_format}]', rows_in=len(df) if positions is None else len(positions)):
+        chunks = iter_chunks(df, positions)
+        if file_format == 'csv':
+            if isinstance(sink, (str, bytes)) or hasattr(sink, '__fspath__'):
+                with open(sink, 'wb') as f:
+                    _write_csv(chunks, f)
+            else:
+                _write_csv(chunks, sink)
+        elif file_format == 'parquet':
+            _write_parquet(chunks, sink)
+        else:
+            _write_xlsx(chunks, sink, list(df.columns))
+
+def export_file(df, file_format, positions=None):
+    """Export into an anonymous temp file and return it rewound, e.g. as st.download_button data"""
+    sink = tempfile.TemporaryFile()
+    write_export(df, sink, file_format, positions)
+    sink.seek(0)
+    return sink
@@ -0,0 +1,123 @@
+# %%
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from aggregates import DIMENSIONS, series_matrix
+from periods import PERIODS_PER_YEAR, period_values
+from profiling import stage
+
+# Forecasts of one metric for every series (dimension combination) of the cube. All series are
+# laid out as one dense series x period matrix, so each model is fitted to all of them at once.
+FORECAST_MODELS = ['Exponential smoothing', 'Seasonal naive']
+FORECAST_HORIZON = {'Month': 6, 'Quarter': 2}
+FORECAST_COLUMNS = ['Forecast', 'Lower', 'Upper']
+INTERVAL_Z = 1.2816 # Bands are 80% prediction intervals
+
+# Holt linear smoothing: (alpha, beta) grid searched per series on the one-step-ahead errors
+SMOOTHING_GRID = [(alpha, beta) for alpha in np.arange(1, 10) / 10 for beta in (0.0, 0.05, 0.1, 0.2) if beta <= alpha]
+
+PARALLEL_MIN_SERIES = 20_000 # Below this, starting a process pool costs more than it saves
+CHUNK_SERIES = 10_000
+
+#%% Models
+def _holt(history, horizon):
+    """Holt linear exponential smoothing of every row of history -> (forecast, std), series x horizon
+
+    Each series starts at its first non-zero period, so series that begin late are not
+    dragged down by the zeros before them.
+    """
+    n_series, n_periods = history.shape
+    alpha = np.array([a for a, _ in SMOOTHING_GRID])[:, None]
+    beta = np.array([b for _, b in SMOOTHING_GRID])[:, None]
+    first = np.where(history.any(axis=1), (history != 0).argmax(axis=1), n_periods)
+
+    level = np.zeros((len(SMOOTHING_GRID), n_series))
+    trend = np.zeros_like(level)
+    sse = np.zeros_like(level)
+    n_errors = np.zeros(n_series)
+    for t in range(n_periods):
+        value, started = history[:, t], t > first
+        error = value - (level + trend)
+        level, trend = (np.where(started, level + trend + alpha * error, value),
+                        np.where(started, trend + beta * error, 0.0))
+        sse += np.where(started, error ** 2, 0.0)
+        n_errors += started
+
+    best = sse.argmin(axis=0)
+    columns = np.arange(n_series)
+    level, trend, sse = level[best, columns], trend[best, columns], sse[best, columns]
+    alpha, beta = alpha[best, 0], beta[best, 0]
+
+    steps = np.arange(1, horizon + 1)
+    forecast = level[:, None] + trend[:, None] * steps
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma2 = np.where(n_errors >= 2, sse / n_errors, np.nan)
+    variance = sigma2[:, None] * (1 + (steps - 1) * (alpha[:, None] ** 2 + alpha[:, None] * beta[:, None] * steps
+                                                     + beta[:, None] ** 2 * steps * (2 * steps - 1) / 6))
+    return forecast, np.sqrt(variance)
+
+def _seasonal_naive(history, horizon, season):
+    """Each future period repeats the same period of the last season -> (forecast, std), series x horizon"""
+    n_series, n_periods = history.shape
+    if n_periods <= season:
+        empty = np.full((n_series, horizon), np.nan)
+        return empty, empty
+    steps = np.arange(horizon)
+    forecast = history[:, n_periods - season + steps % season]
+    residuals = history[:, season:] - history[:, :-season]
+    sigma = np.sqrt((residuals ** 2).mean(axis=1))
+    return forecast, sigma[:, None] * np.sqrt(steps // season + 1)
+
+def _fit(history, model, horizon, season):
+    """(forecast, lower, upper) of every row of history"""
+    if model == 'Seasonal naive':
+        forecast, std = _seasonal_naive(history, horizon, season)
+    else:
+        forecast, std = _holt(history, horizon)
+    floor = np.where(history.min(axis=1) >= 0, 0.0, -np.inf)[:, None] # Non-negative series stay non-negative
+    return (np.maximum(forecast, floor), np.maximum(forecast - INTERVAL_Z * std, floor),
+            np.maximum(forecast + INTERVAL_Z * std, floor))
+
+def _fit_batched(history, model, horizon, season):
+    """_fit over chunks of series on a process pool once there are many series"""
+    if len(history) < PARALLEL_MIN_SERIES:
+        return _fit(history, model, horizon, season)
+    chunks = [history[start:start + CHUNK_SERIES] for start in range(0, len(history), CHUNK_SERIES)]
+    # spawn rather than fork: the dashboard process is multi-threaded
+    with ProcessPoolExecutor(max_workers=min(len(chunks), os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        n = len(chunks)
+        results = list(pool.map(_fit, chunks, [model] * n, [horizon] * n, [season] * n))
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+#%% Forecast table
+@stage('forecast')
+def forecast_cube(cube, time_period, metric, model=FORECAST_MODELS[0], horizon=None):
+    """Forecast of metric for every series of the cube over the next periods
+
+    Returns a table shaped like cube[time_period] - indexed by DIMENSIONS + [time_period],
+    one row per series and future period - with the FORECAST_COLUMNS, so cube_slice
+    selects from it like from the cube. History gaps count as 0.
+    """
+    if model not in FORECAST_MODELS:
+        raise ValueError(f"Unknown forecast model '{model}', expected one of {FORECAST_MODELS}")
+    horizon = horizon or FORECAST_HORIZON[time_period]
+    table = cube[time_period]
+    index = table.index
+    if table.empty:
+        return pd.DataFrame(columns=FORECAST_COLUMNS, index=index[:0], dtype=float)
+
+    series, sizes, first, arrays = series_matrix(table, [metric], time_period)
+    history = arrays[metric]
+    last = first + history.shape[1] - 1
+    results = _fit_batched(history, model, horizon, PERIODS_PER_YEAR[time_period])
+
+    # One row per (series, future period), series in cube order
+    dimension_codes = np.unravel_index(np.repeat(series, horizon), sizes)
+    future = period_values(np.arange(last + 1, last + 1 + horizon), time_period)
+    forecast_index = pd.MultiIndex(levels=list(index.levels[:len(DIMENSIONS)]) + [future],
+                                   codes=list(dimension_codes) + [np.tile(np.arange(horizon), len(series))],
+                                   names=index.names, verify_integrity=False)
+    return pd.DataFrame({column: values.ravel() for column, values in zip(FORECAST_COLUMNS, results)}, index=forecast_index)
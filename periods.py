@@ -0,0 +1,64 @@
+# %%
+import os
+import numpy as np
+import pandas as pd
+
+# Month the fiscal year starts in (1 = calendar year). A fiscal year is named after the calendar
+# year it ends in, e.g. with CASPER_FISCAL_YEAR_START=4 April 2025 - March 2026 is FY2026
+FISCAL_YEAR_START = int(os.environ.get('CASPER_FISCAL_YEAR_START', '1'))
+PERIODS_PER_YEAR = {'Month': 12, 'Quarter': 4}
+EPOCH_YEAR = 1970 # Month keys count months since January 1970, as numpy's datetime64[M] does
+
+#%% Integer period keys
+def month_keys(months):
+    """Month timestamps as int64 months since January 1970 - consecutive months have consecutive keys"""
+    return np.asarray(months, dtype='datetime64[M]').astype(np.int64)
+
+def period_keys(periods, time_period):
+    """Integer keys of Month timestamps or 'YYYYQn' quarter labels (quarter key = month key // 3)
+
+    Only the distinct quarter labels are parsed, so a long column costs one factorize.
+    """
+    if time_period == 'Quarter':
+        codes, labels = pd.factorize(np.asarray(periods, dtype=object))
+        label_keys = np.array([(int(label[:4]) - EPOCH_YEAR) * 4 + int(label[5]) - 1 for label in labels], dtype=np.int64)
+        return label_keys[codes]
+    return month_keys(periods)
+
+def period_values(keys, time_period):
+    """Inverse of period_keys: a DatetimeIndex of months or an Index of 'YYYYQn' labels"""
+    keys = np.asarray(keys, dtype=np.int64)
+    if time_period == 'Quarter':
+        codes, unique_keys = pd.factorize(keys)
+        labels = np.array([f'{EPOCH_YEAR + key // 4}Q{key % 4 + 1}' for key in unique_keys], dtype=object)
+        return pd.Index(labels[codes])
+    return pd.DatetimeIndex(keys.astype('datetime64[M]').astype('datetime64[ns]'))
+
+def quarter_bounds(start, end):
+    """First month of start's quarter and last month of end's quarter, as 'YYYY-MM'"""
+    first, last = month_keys([start, end])
+    return tuple(period_values([first // 3 * 3, last // 3 * 3 + 2], 'Month').strftime('%Y-%m'))
+
+#%% Calendar
+def period_calendar(start, end, fiscal_year_start=FISCAL_YEAR_START):
+    """Period dimension: one row per month from start to end, indexed by month key
+
+    Columns: Month, Year, Month of year, Quarter (label), Quarter key,
+    Fiscal year, Fiscal month (1 = first month of the fiscal year) and Fiscal quarter.
+    """
+    first, last = month_keys([start, end])
+    keys = np.arange(first, last + 1)
+    year, month_of_year = np.divmod(keys, 12)
+    year, month_of_year = year + EPOCH_YEAR, month_of_year + 1
+    fiscal_month = (month_of_year - fiscal_year_start) % 12 + 1
+    fiscal_year = year + ((fiscal_year_start > 1) & (month_of_year >= fiscal_year_start))
+    return pd.DataFrame({
+        'Month': period_values(keys, 'Month'),
+        'Year': year,
+        'Month of year': month_of_year,
+        'Quarter': period_values(keys // 3, 'Quarter'),
+        'Quarter key': keys // 3,
+        'Fiscal year': fiscal_year,
+        'Fiscal month': fiscal_month,
+        'Fiscal quarter': (fiscal_month - 1) // 3 + 1,
+    }, index=pd.Index(keys, name='Month key'))
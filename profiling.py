@@ -0,0 +1,80 @@
+# %%
+import datetime as dt
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import psutil # Optional, portable memory readings
+except ImportError:
+    psutil = None
+
+# Every pipeline stage emits one JSON record on this logger and keeps it in a ring buffer for the debug panel
+logger = logging.getLogger('casper.pipeline')
+RECENT_STAGES = 500
+
+_recent = deque(maxlen=RECENT_STAGES)
+_local = threading.local()
+_sequence = itertools.count() # Start order across threads
+
+#%%
+def _rss():
+    """Resident memory of this process in bytes (None where it cannot be read)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Record wall time, rows in/out and memory delta of one pipeline stage
+
+        with stage('clean_data', rows_in=len(raw)) as record:
+            df = ...
+            record['rows_out'] = len(df)
+
+    Also usable as a decorator (@stage('build_cube')). Nested stages record their parent.
+    """
+    stack = _local.__dict__.setdefault('stack', [])
+    record = {'seq': next(_sequence), 'stage': name, 'parent': stack[-1] if stack else None, 'depth': len(stack),
+              'thread': threading.current_thread().name, 'started': dt.datetime.now().isoformat(timespec='milliseconds'),
+              'rows_in': rows_in, 'rows_out': None}
+    stack.append(name)
+    memory_before = _rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = repr(error)
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        memory_after = _rss()
+        record['memory_delta_mb'] = (None if memory_before is None or memory_after is None
+                                     else round((memory_after - memory_before) / 2**20, 2))
+        stack.pop()
+        _recent.append(record)
+        logger.info(json.dumps(record, default=str))
+
+def recent_stages():
+    """Stage records of this process, oldest first (at most RECENT_STAGES)"""
+    return sorted(_recent, key=lambda record: record['seq'])
+
+def stage_table(records=None):
+    """Recent stages as a DataFrame, stage names indented by nesting depth"""
+    table = pd.DataFrame(recent_stages() if records is None else records,
+                         columns=['started', 'thread', 'stage', 'depth', 'seconds', 'rows_in', 'rows_out', 'memory_delta_mb'])
+    table['stage'] = ['  ' * depth + name for depth, name in zip(table['depth'], table['stage'])]
+    return table.drop(columns='depth').astype({'rows_in': 'Int64', 'rows_out': 'Int64'})
+
+def clear_stages():
+    _recent.clear()
@@ -0,0 +1,77 @@
+# %%
+import argparse
+import json
+import numpy as np
+from pathlib import Path
+from aggregates import ALL, DIMENSIONS, METRICS, TIME_PERIODS, build_cube, cube_slice, yoy_change
+from data_processing import read_partitions, sync_partitions
+
+# Headless access to the aggregated sales data - no Streamlit or Plotly needed
+
+#%% Loading
+def load_cube():
+    """Sync the month partitions of every source and pre-aggregate them for querying
+
+    Covers the main workbook and every export in raw_exports/, as the dashboard does.
+    """
+    sync_partitions()
+    return build_cube(read_partitions())
+
+#%% Queries
+def query(cube, channels=(ALL,), divisions=(ALL,), regions=(ALL,), products=(ALL,), metric='Sales amount',
+          grain='Month', yoy=False, as_arrow=False):
+    """
+    Tidy time series of one or more metrics for a channel/division/region/product selection
+
+    Parameters:
+    - cube: pre-aggregated data from load_cube / aggregates.build_cube
+    - channels, divisions, regions, products: values to include, 'ALL' sums across the dimension
+    - metric: one measure name or a list of them, including the rolling views ('Sales amount TTM', ...)
+    - grain: 'Month' or 'Quarter'
+    - yoy: add a '<metric> YoY %' column per metric (NaN when the prior-year period is missing)
+    - as_arrow: return a pyarrow.Table instead of a DataFrame
+
+    Returns one row per series and period with the grain, the four dimensions and the metrics.
+    """
+    metrics = [metric] if isinstance(metric, str) else list(metric)
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric(s) {unknown}, expected any of {METRICS}")
+    if grain not in TIME_PERIODS:
+        raise ValueError(f"Unknown grain '{grain}', expected one of {TIME_PERIODS}")
+
+    # A selection without data (e.g. a channel that never sold a division) gives an empty frame with the same columns
+    rows = cube_slice(cube, grain, channels, divisions, regions, products)[[grain] + DIMENSIONS + metrics]
+    if yoy:
+        for m in metrics:
+            rows[f'{m} YoY %'] = yoy_change(rows, grain, m, series_columns=DIMENSIONS)['YoY'] if len(rows) else np.nan
+    rows = rows.sort_values(DIMENSIONS + [grain], ignore_index=True)
+
+    if as_arrow:
+        import pyarrow as pa
+        return pa.Table.from_pandas(rows, preserve_index=False)
+    return rows
+
+def run_queries(cube, queries):
+    """Run many query() calls against one loaded cube
+
+    queries: iterable of keyword-argument dicts for query(). Returns the results in the same order.
+    """
+    return [query(cube, **params) for params in queries]
+
+
+#%% Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a batch of sales queries without the dashboard')
+    parser.add_argument('queries', type=Path, help='JSON file with a list of {"name": ..., <query() arguments>}')
+    parser.add_argument('--output-dir', type=Path, default=Path('query_results'))
+    args = parser.parse_args()
+
+    batch = json.loads(args.queries.read_text())
+    names = [params.pop('name', f'query_{i}') for i, params in enumerate(batch)]
+
+    cube = load_cube()
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for name, result in zip(names, run_queries(cube, batch)):
+        result.to_csv(args.output_dir / f'{name}.csv', index=False)
+    print(f"Wrote {len(names)} query results to '{args.output_dir}'")
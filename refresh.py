@@ -0,0 +1,142 @@
+# %%
+import itertools
+import threading
+import traceback
+from collections import namedtuple
+import pandas as pd
+from aggregates import build_cube_by_parts, cube_periods
+from anomalies import scan_anomalies
+from data_processing import LABEL_MAPPINGS_FILE, compact_dataset, dataset_version, partition_months, raw_sources, read_partitions, sync_partitions
+from profiling import stage
+
+REFRESH_INTERVAL = 30 # Seconds between checks of the raw exports
+
+# One published version of the cleaned data: every partition month, the rows (None unless
+# kept for shared snapshots), their cube and the anomalies found in it (see anomalies.scan_anomalies)
+Snapshot = namedtuple('Snapshot', ['version', 'months', 'df', 'cube', 'anomalies'])
+
+#%%
+def sources_stamp():
+    """Cheap change detector: name, size and mtime of every raw export and of the label mappings"""
+    stamp = []
+    for path in raw_sources() + [LABEL_MAPPINGS_FILE]:
+        stat = path.stat()
+        stamp.append((path.name, stat.st_size, stat.st_mtime_ns))
+    return stamp
+
+@stage('load_snapshot')
+def load_snapshot(compact=False, keep_rows=False):
+    """Snapshot of the partitions currently on disk (None if nothing has been synced yet)
+
+    The cube is built one year of partitions at a time, so only that year's rows are in
+    memory at once; keep_rows=True also keeps all the rows in the snapshot.
+    compact=True keeps the float32, dashboard-only columns of data_processing.compact_dataset.
+    """
+    version = dataset_version()
+    months = partition_months(version) if version else [] # Pinned, so a sync running meanwhile cannot mix versions
+    if not months:
+        return None
+    kept = []
+    def year_frames():
+        for _, year_months in itertools.groupby(months, key=lambda month: month[:4]):
+            year_months = list(year_months)
+            df = read_partitions(year_months[0], year_months[-1], version)
+            if compact:
+                df = compact_dataset(df)
+            if keep_rows:
+                kept.append(df)
+            yield df
+    cube = build_cube_by_parts(year_frames())
+    df = pd.concat(kept, ignore_index=True) if keep_rows else None
+    return Snapshot(version, months, df, cube, scan_anomalies(cube))
+
+def period_rows(snapshot, start, end):
+    """Full-precision cleaned rows of the months start..end, read from their partitions only
+
+    Rows come from the snapshot's own dataset version (see data_processing.read_partitions),
+    in the same order as those of period_view, even while a newer version is being synced.
+    """
+    return read_partitions(start, end, snapshot.version)
+
+def period_view(snapshot, start, end, compact=True):
+    """(rows, cube) of a snapshot restricted to the months start..end ('YYYY-MM', inclusive)
+
+    The cube is sliced from the snapshot's cube (see aggregates.cube_periods), so rolling
+    metrics near the start of the range still look back before it. Rows are taken from the
+    snapshot when it keeps them (shared snapshots); otherwise only the partitions of the
+    range are read (see period_rows), compacted unless compact=False.
+    """
+    full_range = (start, end) == (snapshot.months[0], snapshot.months[-1])
+    cube = snapshot.cube if full_range else cube_periods(snapshot.cube, start, end)
+    if snapshot.df is None:
+        df = period_rows(snapshot, start, end)
+        return (compact_dataset(df) if compact else df), cube
+    if full_range:
+        return snapshot.df, cube
+    month = snapshot.df['Month']
+    return snapshot.df[(month >= pd.Timestamp(start)) & (month <= pd.Timestamp(end))].reset_index(drop=True), cube
+
+class RefreshWorker:
+    """Daemon thread that re-syncs the partitions when a raw export changes
+
+    Cleaning, partition writes and cube building all happen on the worker thread.
+    Readers get the last published Snapshot until a new one is swapped in whole.
+    Snapshots are compact (see data_processing.compact_dataset) unless compact=False, and
+    only keep the cube - sessions read the rows of their period range (see period_view).
+    """
+    keep_rows = False
+    def __init__(self, interval=REFRESH_INTERVAL, compact=True):
+        self.interval = interval
+        self.compact = compact
+        self.error = None # Traceback of the last failed refresh, cleared by the next success
+        self._snapshot = None
+        self._stamp = None
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='data-refresh', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def snapshot(self, timeout=None):
+        """The current snapshot, waiting only if no data has been published yet"""
+        self._ready.wait(timeout)
+        return self._snapshot
+
+    def refresh_now(self):
+        """Check the raw exports without waiting for the next interval"""
+        self._wake.set()
+
+    def _publish(self, snapshot):
+        if snapshot is not None:
+            self._snapshot = snapshot # Single reference assignment - readers see the old or the new snapshot
+            self._ready.set()
+
+    def _refresh(self):
+        stamp = sources_stamp()
+        if stamp == self._stamp:
+            return
+        sync_partitions()
+        self._stamp = stamp
+        if self._snapshot is None or dataset_version() != self._snapshot.version:
+            self._publish(load_snapshot(self.compact, self.keep_rows))
+
+    def _serve_existing(self):
+        """Serve whatever is already on disk straight away, before bringing it up to date"""
+        self._publish(load_snapshot(self.compact, self.keep_rows))
+
+    def _run(self):
+        try:
+            self._serve_existing()
+        except Exception:
+            self.error = traceback.format_exc()
+        while True:
+            try:
+                self._refresh()
+                self.error = None
+            except Exception:
+                self.error = traceback.format_exc()
+            self._ready.set() # Let waiting readers see the error rather than block forever
+            self._wake.wait(self.interval)
+            self._wake.clear()
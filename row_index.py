@@ -0,0 +1,38 @@
+# %%
+import numpy as np
+from aggregates import ALL, DIMENSIONS
+
+# Inverted index over the row-level data: dimension -> value -> sorted row positions.
+# Multi-select filters then resolve by set union/intersection of small position arrays
+# instead of chains of full-column boolean masks.
+
+#%%
+def build_row_index(df, dimensions=DIMENSIONS):
+    """{dimension: {value: sorted int64 row positions}} built from the categorical codes"""
+    index = {}
+    for dimension in dimensions:
+        values = df[dimension].astype('category')
+        codes = values.cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable') # Stable, so each value's positions stay sorted
+        bounds = np.searchsorted(codes[order], np.arange(len(values.cat.categories) + 1))
+        index[dimension] = {
+            value: order[bounds[code]:bounds[code + 1]]
+            for code, value in enumerate(values.cat.categories)
+            if bounds[code + 1] > bounds[code]
+        }
+    return index
+
+def select_rows(row_index, selections):
+    """Row positions matching every {dimension: [values]} selection (None = all rows)
+
+    A selection containing 'ALL' does not filter its dimension.
+    """
+    positions = None
+    for dimension, selected in selections.items():
+        if ALL in selected:
+            continue
+        postings = row_index[dimension]
+        matched = [postings[value] for value in selected if value in postings]
+        rows = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+        positions = rows if positions is None else np.intersect1d(positions, rows, assume_unique=True)
+    return positions
@@ -0,0 +1,139 @@
+# %%
+import argparse
+import json
+import os
+import shutil
+import threading
+import pandas as pd
+import pyarrow as pa
+from aggregates import DIMENSIONS, TIME_PERIODS
+from data_processing import CACHE_DIR, sync_partitions
+from profiling import stage
+from refresh import REFRESH_INTERVAL, RefreshWorker, Snapshot, load_snapshot
+
+# Several dashboard processes on one host share one copy of the data: a single publisher
+# writes every snapshot as Arrow IPC files, the dashboards memory-map them
+SNAPSHOTS_DIR = CACHE_DIR / 'snapshots'
+CURRENT_FILE = SNAPSHOTS_DIR / 'current.json'
+KEEP_SNAPSHOTS = 2 # The current one and its predecessor, which readers may still be switching away from
+
+#%% Arrow files
+def _frame_to_table(df):
+    """Arrow table of a flat frame - categoricals as dictionary arrays, NaN kept as NaN (not null) so reads are zero-copy"""
+    arrays = []
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays.append(pa.DictionaryArray.from_arrays(values.cat.codes.to_numpy(), pa.array(values.cat.categories.to_numpy())))
+        else:
+            arrays.append(pa.array(values.to_numpy()))
+    return pa.Table.from_arrays(arrays, names=list(df.columns))
+
+def _write_table(table, path):
+    with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def _read_table(path):
+    """Frame backed by the memory-mapped file: numeric columns are views of the mapped pages"""
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    return table.to_pandas(split_blocks=True)
+
+def _cube_frame(table):
+    """Cube table with its (sorted) index levels stored as categoricals, so the MultiIndex is rebuilt without sorting"""
+    index = table.index
+    levels = {name: pd.Categorical.from_codes(index.codes[i], index.levels[i]) for i, name in enumerate(index.names)}
+    return pd.concat([pd.DataFrame(levels), table.reset_index(drop=True)], axis=1)
+
+def _cube_table(frame, index_names):
+    levels = [frame[name] for name in index_names]
+    index = pd.MultiIndex(levels=[pd.Index(level.cat.categories) for level in levels],
+                          codes=[level.cat.codes.to_numpy() for level in levels], names=index_names, verify_integrity=False)
+    return frame.drop(columns=index_names).set_axis(index)
+
+#%% Publishing and opening
+@stage('write_shared_snapshot')
+def write_snapshot(snapshot):
+    """Write a snapshot under SNAPSHOTS_DIR/<version>/ and point current.json at it"""
+    target = SNAPSHOTS_DIR / snapshot.version
+    if not target.exists():
+        tmp_dir = SNAPSHOTS_DIR / f'{snapshot.version}.tmp-{os.getpid()}'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        _write_table(_frame_to_table(snapshot.df), tmp_dir / 'rows.arrow')
+        for time_period in TIME_PERIODS:
+            _write_table(_frame_to_table(_cube_frame(snapshot.cube[time_period])), tmp_dir / f'{time_period}.arrow')
+        _write_table(_frame_to_table(_cube_frame(snapshot.anomalies)), tmp_dir / 'anomalies.arrow')
+        (tmp_dir / 'meta.json').write_text(json.dumps({'version': snapshot.version, 'months': snapshot.months}))
+        tmp_dir.replace(target) # Readers only ever see complete snapshot directories
+
+    tmp_file = CURRENT_FILE.with_suffix('.json.tmp')
+    tmp_file.write_text(json.dumps({'version': snapshot.version}))
+    tmp_file.replace(CURRENT_FILE)
+    _prune(snapshot.version)
+
+def _prune(current):
+    snapshots = sorted((path for path in SNAPSHOTS_DIR.iterdir() if path.is_dir() and '.tmp-' not in path.name),
+                       key=lambda path: path.stat().st_mtime)
+    for path in snapshots[:-KEEP_SNAPSHOTS]:
+        if path.name != current:
+            shutil.rmtree(path, ignore_errors=True) # Still-mapped files stay readable on POSIX; Windows keeps them until unmapped
+
+def current_version():
+    """Version of the latest published snapshot (None if nothing has been published)"""
+    try:
+        return json.loads(CURRENT_FILE.read_text())['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+@stage('open_shared_snapshot')
+def open_snapshot(version):
+    """Snapshot memory-mapped from SNAPSHOTS_DIR/<version>/"""
+    directory = SNAPSHOTS_DIR / version
+    meta = json.loads((directory / 'meta.json').read_text())
+    cube = {time_period: _cube_table(_read_table(directory / f'{time_period}.arrow'), DIMENSIONS + [time_period])
+            for time_period in TIME_PERIODS}
+    anomalies_file = directory / 'anomalies.arrow' # Not in snapshots published before the anomaly scan
+    anomalies = _cube_table(_read_table(anomalies_file), ['Month'] + DIMENSIONS) if anomalies_file.exists() else None
+    return Snapshot(meta['version'], meta['months'], _read_table(directory / 'rows.arrow'), cube, anomalies)
+
+#%% Workers
+class PublishingWorker(RefreshWorker):
+    """RefreshWorker that also writes every snapshot it publishes to the shared Arrow files"""
+    keep_rows = True # Readers memory-map the rows instead of reading partitions
+    def _publish(self, snapshot):
+        if snapshot is not None:
+            write_snapshot(snapshot)
+        super()._publish(snapshot)
+
+class SharedSnapshotReader(RefreshWorker):
+    """Drop-in for RefreshWorker in dashboard processes: follows the snapshots a PublishingWorker writes
+
+    Never cleans or aggregates anything itself, so extra processes only add the
+    mapped pages they touch, and those are shared through the OS page cache.
+    """
+    def _serve_existing(self):
+        pass # The first _refresh opens the current snapshot
+
+    def _refresh(self):
+        version = current_version()
+        if version is None:
+            raise FileNotFoundError(f"No shared snapshot in '{SNAPSHOTS_DIR}' - start the publisher: python shared_snapshot.py")
+        if self._snapshot is None or version != self._snapshot.version:
+            self._publish(open_snapshot(version))
+
+
+#%% Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Keep the shared, memory-mapped snapshot of the sales data up to date')
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL, help='Seconds between checks of the raw exports')
+    parser.add_argument('--once', action='store_true', help='Publish the current data and exit')
+    args = parser.parse_args()
+
+    if args.once:
+        sync_partitions()
+        snapshot = load_snapshot(compact=True, keep_rows=True)
+        write_snapshot(snapshot)
+        print(f"Published snapshot {snapshot.version} ({snapshot.months[0]} to {snapshot.months[-1]}) to '{SNAPSHOTS_DIR}'")
+    else:
+        print(f"Publishing snapshots to '{SNAPSHOTS_DIR}' - checking the raw exports every {args.interval:g}s")
+        PublishingWorker(interval=args.interval).start()
+        threading.Event().wait() # The worker thread does the publishing
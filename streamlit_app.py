@@ -1,157 +1,194 @@
 # %%
+import itertools
+import os
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-from data_processing import load_and_clean_data
+from plotly.colors import hex_to_rgb, qualitative
+from aggregates import (ALL, DIMENSIONS, METRICS, ROLLING_BASES, ROLLING_METRICS, SEQUENTIAL_CHANGE, cube_slice, period_label,
+                        shift_period, summarize, yoy_percent)
+from anomalies import select_anomalies
+from bridge import price_volume_mix
+from export import EXPORT_FORMATS, export_file
+from forecast import FORECAST_MODELS, forecast_cube
+from periods import PERIODS_PER_YEAR, quarter_bounds
+from profiling import stage, stage_table
+from query import query
+from refresh import RefreshWorker, period_rows, period_view
+from shared_snapshot import SharedSnapshotReader
+from row_index import build_row_index, select_rows
+from view_cache import ViewCache, normalize_selection
+
+VIEW_CACHE_SIZE = 64 # Figures/summaries kept per process
+MAX_SERIES = 12 # Lines drawn per chart - smaller series are summed into one 'Others' line
+WEBGL_MIN_POINTS = 2000 # Charts with more points than this are drawn with WebGL (Scattergl)
+ANOMALY_ROWS = 100 # Rows shown in the 'What changed' panel
+SHARED_SNAPSHOTS = os.environ.get('CASPER_SHARED_SNAPSHOTS') == '1' # Read the data published by shared_snapshot.py
 
 #%% Plotting function
-def plot_sales_by_month(df, channels=None, divisions=None, metric='Sales amount', time_period='Month', show_yoy=False):
+@stage('plot_sales_by_month')
+def plot_sales_by_month(cube, channels=None, divisions=None, metric='Sales amount', time_period='Month', show_yoy=False,
+                        regions=('ALL',), products=('ALL',), max_series=MAX_SERIES, forecast=None, history=None):
     """
-    Plot sales data by month or quarter with flexible channel and division selection
+    Plot sales data by month or quarter with flexible channel, division, region and product selection
     
     Parameters:
-    - df: DataFrame with sales data
+    - cube: pre-aggregated data from aggregates.build_cube
     - channels: list of channels to include (None = all channels)
     - divisions: list of divisions to include (None = all divisions) 
-    - metric: 'Sales amount', 'Total volume', or 'Actual sales volume'
+    - metric: 'Sales amount', 'Total volume', or 'Actual sales volume', or one of their rolling views
+      ('Sales amount YTD', 'Sales amount TTM', 'Sales amount 3M avg', ...)
     - time_period: 'Month' or 'Quarter'
     - show_yoy: Boolean to show Year-over-Year percentage
+    - regions: list of regions to break down by ('ALL' = summed across regions)
+    - products: list of product types to break down by ('ALL' = summed across product types)
+    - max_series: keep the largest series (by total metric) and sum the rest into 'Others' (None = no cap)
+    - forecast: forecast.forecast_cube table of this metric and time_period, drawn as a dashed line
+      with its band after each series (not with show_yoy, nor for the 'Others' line)
+    - history: cube the YoY % looks the prior year up in, when cube only holds a Period range
+      (see aggregates.cube_periods) - only the periods of cube are drawn
     """
     # Get unique values if not specified
     if channels is None:
-        channels = df['Distribution channel'].unique()
+        channels = [c for c in cube[time_period].index.unique('Distribution channel') if c != ALL]
     if divisions is None:
-        divisions = df['Division'].unique()
-    
-    # Check for 'ALL' selections
-    select_all_channels = 'ALL' in channels
-    select_all_divisions = 'ALL' in divisions
-    
-    # Filter data
-    if select_all_channels and select_all_divisions:
-        filtered_df = df.copy()
-    elif select_all_channels:
-        filtered_df = df[df['Division'].isin([d for d in divisions if d != 'ALL'])].copy()
-    elif select_all_divisions:
-        filtered_df = df[df['Distribution channel'].isin([c for c in channels if c != 'ALL'])].copy()
-    else:
-        filtered_df = df[
-            (df['Distribution channel'].isin(channels)) & 
-            (df['Division'].isin(divisions))
-        ].copy()
-    
-    # Add quarter column if needed
-    if time_period == 'Quarter':
-        filtered_df['Quarter'] = pd.PeriodIndex(filtered_df['Month'], freq='Q')
-        filtered_df['Quarter'] = filtered_df['Quarter'].astype(str)
-        time_col = 'Quarter'
-    else:
-        time_col = 'Month'
-    
-    # Determine grouping columns based on ALL selections
-    if select_all_channels and select_all_divisions:
-        # Group only by time
-        grouped = filtered_df.groupby([time_col])[metric].sum().reset_index()
-        grouped['Distribution channel'] = 'ALL'
-        grouped['Division'] = 'ALL'
-    elif select_all_channels:
-        # Group by time and division
-        grouped = filtered_df.groupby([time_col, 'Division'])[metric].sum().reset_index()
-        grouped['Distribution channel'] = 'ALL'
-    elif select_all_divisions:
-        # Group by time and channel
-        grouped = filtered_df.groupby([time_col, 'Distribution channel'])[metric].sum().reset_index()
-        grouped['Division'] = 'ALL'
-    else:
-        # Group by all three dimensions
-        grouped = filtered_df.groupby([time_col, 'Distribution channel', 'Division'])[metric].sum().reset_index()
+        divisions = [d for d in cube[time_period].index.unique('Division') if d != ALL]
     
-    # Create figure
-    fig = go.Figure()
+    # Selected values per dimension, in series-name order ('ALL' = summed across the dimension)
+    selections = {
+        'Distribution channel': channels,
+        'Region': regions,
+        'Division': divisions,
+        'Type of product': products,
+    }
+    to_plot = {dim: ['ALL'] if 'ALL' in values else [v for v in values if v != 'ALL'] for dim, values in selections.items()}
     
-    # If YoY is requested, calculate it
-    if show_yoy:
-        grouped = grouped.copy()
-        grouped['Year'] = pd.to_datetime(grouped[time_col]).dt.year if time_col == 'Month' else grouped[time_col].str[:4].astype(int)
+    # Look up the pre-aggregated series instead of filtering and grouping the rows
+    time_col = time_period
+    source = cube if history is None else history
+    grouped = cube_slice(source, time_period, channels, divisions, regions, products)[[time_col] + DIMENSIONS + [metric]]
+    shown = grouped[time_col].isin(cube[time_period].index.levels[-1]) # Periods drawn - any others are only YoY history
+    
+    # Series in selection order, each named after its selected values
+    series_columns = list(selections)
+    present = set(grouped[shown].set_index(series_columns).index)
+    trace_names = {}
+    for series in itertools.product(*to_plot.values()):
+        if series not in present:
+            continue
+        channel, region, division, product = series
         
-        # Calculate YoY for each combination
-        yoy_data = []
-        for channel in grouped['Distribution channel'].unique():
-            for division in grouped['Division'].unique():
-                subset = grouped[
-                    (grouped['Distribution channel'] == channel) & 
-                    (grouped['Division'] == division)
-                ].copy()
-                
-                if not subset.empty:
-                    if time_col == 'Month':
-                        subset['Month_of_year'] = pd.to_datetime(subset['Month']).dt.month
-                        subset['YoY'] = subset.groupby('Month_of_year')[metric].pct_change(periods=1) * 100
-                    else:
-                        subset['Quarter_of_year'] = subset['Quarter'].str[-1].astype(int)
-                        subset['YoY'] = subset.groupby('Quarter_of_year')[metric].pct_change(periods=1) * 100
-                    
-                    yoy_data.append(subset)
+        # Create name based on selection
+        if channel == 'ALL' and division == 'ALL':
+            trace_name = 'All Channels - All Divisions'
+        elif channel == 'ALL':
+            trace_name = f'All Channels - {division}'
+        elif division == 'ALL':
+            trace_name = f'{channel} - All Divisions'
+        else:
+            trace_name = f'{channel} - {division}'
         
-        if yoy_data:
-            grouped = pd.concat(yoy_data, ignore_index=True)
-    
-    # Add traces for each channel-division combination
-    channels_to_plot = ['ALL'] if select_all_channels else [c for c in channels if c != 'ALL']
-    divisions_to_plot = ['ALL'] if select_all_divisions else [d for d in divisions if d != 'ALL']
-    
-    for channel in channels_to_plot:
-        for division in divisions_to_plot:
-            data_subset = grouped[
-                (grouped['Distribution channel'] == channel) & 
-                (grouped['Division'] == division)
-            ]
-            
-            if not data_subset.empty:
-                # Create name based on selection
-                if channel == 'ALL' and division == 'ALL':
-                    trace_name = 'All Channels - All Divisions'
-                elif channel == 'ALL':
-                    trace_name = f'All Channels - {division}'
-                elif division == 'ALL':
-                    trace_name = f'{channel} - All Divisions'
-                else:
-                    trace_name = f'{channel} - {division}'
-                
-                if show_yoy:
-                    # Plot YoY percentage
-                    fig.add_trace(go.Scatter(
-                        x=data_subset[time_col],
-                        y=data_subset['YoY'],
-                        mode='lines+markers',
-                        name=trace_name,
-                        line=dict(width=2),
-                        marker=dict(size=6),
-                        hovertemplate='%{x}<br>YoY: %{y:.1f}%<br>' + f'{metric}: %{{text}}<extra></extra>',
-                        text=[f'{v:,.0f}' for v in data_subset[metric]]
-                    ))
-                else:
-                    # Plot absolute values
-                    fig.add_trace(go.Scatter(
-                        x=data_subset[time_col],
-                        y=data_subset[metric],
-                        mode='lines+markers',
-                        name=trace_name,
-                        line=dict(width=2),
-                        marker=dict(size=6)
-                    ))
+        # Region and product only appear in the name when broken down by them
+        if region != 'ALL':
+            trace_name += f' - {region}'
+        if product != 'ALL':
+            trace_name += f' - {product}'
+        trace_names[series] = trace_name
+    
+    # One (period x series) table for all traces; NaN where a series has no row for the period
+    values = grouped.set_index([time_col] + series_columns)[metric].unstack(series_columns)
+    values = values.reindex(columns=pd.MultiIndex.from_tuples(list(trace_names), names=series_columns))
+    values.columns = list(trace_names.values())
+    in_view = values.index.isin(cube[time_period].index.levels[-1])
+    
+    # Cap the number of lines: the smallest series are summed into one 'Others' line
+    if max_series and values.shape[1] > max_series:
+        totals = values[in_view].abs().sum()
+        keep = set(totals.nlargest(max_series - 1).index)
+        others = [name for name in values.columns if name not in keep]
+        values = values[[name for name in values.columns if name in keep]].assign(
+            **{f'Others ({len(others)} series)': values[others].sum(axis=1, min_count=1)})
+    
+    # If YoY is requested, calculate it for all series at once from the year-lagged rows
+    if show_yoy:
+        yoy = yoy_percent(values, time_col)[in_view]
+    values = values[in_view]
+    
+    # Build every trace from the table in one pass, with WebGL once the chart gets large
+    scatter = go.Scattergl if values.notna().to_numpy().sum() > WEBGL_MIN_POINTS else go.Scatter
+    traces = []
+    for trace_name in values.columns:
+        rows = values[trace_name].notna()
+        x = values.index[rows]
+        
+        if show_yoy:
+            # Plot YoY percentage
+            traces.append(scatter(
+                x=x,
+                y=yoy[trace_name][rows],
+                mode='lines+markers',
+                name=trace_name,
+                line=dict(width=2),
+                marker=dict(size=6),
+                hovertemplate='%{x}<br>YoY: %{y:.1f}%<br>' + f'{metric}: %{{text}}<extra></extra>',
+                text=[f'{v:,.0f}' for v in values[trace_name][rows]]
+            ))
+        else:
+            # Plot absolute values
+            traces.append(scatter(
+                x=x,
+                y=values[trace_name][rows],
+                mode='lines+markers',
+                name=trace_name,
+                line=dict(width=2),
+                marker=dict(size=6)
+            ))
+    
+    # Forecasts continue each series from its last actual point, in the series' colour
+    if forecast is not None and not show_yoy:
+        bands = cube_slice({time_col: forecast}, time_col, channels, divisions, regions, products)
+        bands = bands.set_index(series_columns + [time_col]).sort_index()
+        forecast_series = set(bands.index.droplevel(-1))
+        drawn = {trace_name: series for series, trace_name in trace_names.items()}
+        for i, trace_name in enumerate(values.columns):
+            series = drawn.get(trace_name)
+            if series not in forecast_series:
+                continue
+            band = bands.loc[series]
+            last = values[trace_name].last_valid_index()
+            x = [last] + list(band.index)
+            color = qualitative.Plotly[i % len(qualitative.Plotly)]
+            traces[i].update(line_color=color, legendgroup=trace_name)
+            traces.append(scatter(x=x, y=[values.at[last, trace_name]] + list(band['Upper']), mode='lines',
+                                  line=dict(width=0), legendgroup=trace_name, showlegend=False, hoverinfo='skip'))
+            traces.append(scatter(x=x, y=[values.at[last, trace_name]] + list(band['Lower']), mode='lines',
+                                  line=dict(width=0), fill='tonexty', fillcolor='rgba({}, {}, {}, 0.2)'.format(*hex_to_rgb(color)),
+                                  legendgroup=trace_name, showlegend=False, hoverinfo='skip'))
+            traces.append(scatter(
+                x=x,
+                y=[values.at[last, trace_name]] + list(band['Forecast']),
+                mode='lines',
+                name=f'{trace_name} (forecast)',
+                legendgroup=trace_name,
+                line=dict(width=2, dash='dash', color=color),
+                customdata=[[values.at[last, trace_name]] * 2] + band[['Lower', 'Upper']].to_numpy().tolist(),
+                hovertemplate='%{x}<br>Forecast: %{y:,.1f} (%{customdata[0]:,.1f} - %{customdata[1]:,.1f})<extra></extra>'
+            ))
+    
+    # Create figure
+    fig = go.Figure(data=traces)
     
     # Update layout
     if show_yoy:
         title_text = f'{metric} - Year over Year % Change by {time_period}'
         yaxis_label = 'YoY Change (%)'
     else:
-        unit = 'Billion VND' if metric == 'Sales amount' else 'Units'
+        unit = 'Billion VND' if metric.startswith('Sales amount') else 'Units'
         title_text = f'{metric} by {time_period}'
         yaxis_label = f'{metric} ({unit})'
     
     # Count unique time periods to adjust layout
-    unique_periods = grouped[time_col].nunique()
+    unique_periods = grouped.loc[shown, time_col].nunique()
     
     # Adjust figure width based on number of data points
     if unique_periods <= 4:
@@ -161,8 +198,14 @@ def plot_sales_by_month(df, channels=None, divisions=None, metric='Sales amount'
     else:
         fig_width = None  # Use default/full width
     
+    subtitle = f'Channels: {", ".join([c for c in channels if c != "ALL"])} | Divisions: {", ".join([d for d in divisions if d != "ALL"])}'
+    if 'ALL' not in regions:
+        subtitle += f' | Regions: {", ".join(regions)}'
+    if 'ALL' not in products:
+        subtitle += f' | Products: {", ".join(products)}'
+    
     fig.update_layout(
-        title=f'{title_text}<br><sub>Channels: {", ".join([c for c in channels if c != "ALL"])} | Divisions: {", ".join([d for d in divisions if d != "ALL"])}</sub>',
+        title=f'{title_text}<br><sub>{subtitle}</sub>',
         xaxis_title=time_period,
         yaxis_title=yaxis_label,
         hovermode='x unified',
@@ -188,28 +231,127 @@ def plot_sales_by_month(df, channels=None, divisions=None, metric='Sales amount'
     # Format y-axis
     if show_yoy:
         fig.update_yaxes(tickformat='.1f', ticksuffix='%')
-    elif metric == 'Sales amount':
+    elif metric.startswith('Sales amount'):
         fig.update_yaxes(tickformat=',.1f')
     
     return fig
 
+@stage('plot_price_volume_mix')
+def plot_price_volume_mix(bridge, base_label, current_label):
+    """Waterfall of a bridge.price_volume_mix table, from the base to the current period's Sales amount"""
+    steps = [{'Base': base_label, 'Current': current_label}.get(step, step) for step in bridge['Step']]
+    fig = go.Figure(go.Waterfall(
+        x=steps,
+        y=bridge['Sales amount'],
+        measure=bridge['Kind'],
+        text=[f'{value:+,.1f}' if kind == 'relative' else f'{value:,.1f}' for value, kind in zip(bridge['Sales amount'], bridge['Kind'])],
+        textposition='outside',
+        connector=dict(line=dict(color='rgb(160, 160, 160)')),
+        hovertemplate='%{x}<br>%{text}B VND<extra></extra>'
+    ))
+    fig.update_layout(
+        title=f'Sales amount bridge: {base_label} to {current_label}<br><sub>Price = Sales amount / Actual sales volume</sub>',
+        yaxis_title='Sales amount (Billion VND)',
+        template='plotly_white',
+        height=500,
+        showlegend=False,
+        margin=dict(l=80, r=40, t=100, b=80)
+    )
+    fig.update_yaxes(tickformat=',.1f')
+    return fig
+
+#%% Summary statistics
+# KPI cards: (label, measure, value format)
+SUMMARY_CARDS = [
+    ('Sales', 'Sales amount', '{:,.1f}B VND'),
+    ('Volume', 'Total volume', '{:,.0f} units'),
+    ('Actual Volume', 'Actual sales volume', '{:,.0f} units'),
+]
+
+@stage('raw_data_preview')
+def raw_data_preview(df, row_index, selections):
+    """Latest 100 rows of the selection for the 'View Raw Data' table
+
+    selections: {dimension: [values]} resolved through the inverted row index (see row_index.py)
+    """
+    positions = select_rows(row_index, selections)
+    filtered_df = df if positions is None else df.iloc[positions]
+    
+    return (
+        filtered_df[['Month', 'Distribution channel', 'Region', 'Division', 'Type of product',
+                     'Sales amount', 'Total volume', 'Actual sales volume']]
+        .sort_values('Month', ascending=False)
+        .head(100)
+    )
+
+@stage('anomaly_view')
+def anomaly_view(anomalies, start, end, selections, all_series=False):
+    """Anomalies of the months start..end ('YYYY-MM') for the 'What changed' panel, latest and largest first
+
+    selections: {dimension: [values]} - ignored with all_series
+    """
+    rows = select_anomalies(anomalies, start, end, selections['Distribution channel'], selections['Division'],
+                            selections['Region'], selections['Type of product'], all_series=all_series)
+    rows = rows.reset_index().assign(size=rows['Robust z'].abs().to_numpy())
+    rows = rows.sort_values(['Month', 'size'], ascending=False).head(ANOMALY_ROWS).drop(columns='size')
+    return rows.assign(Month=rows['Month'].dt.strftime('%Y-%m'))
+
 #%% Streamlit App
+@st.cache_resource
+def get_refresh_worker():
+    """Background worker that keeps the cleaned data and cube current for all sessions
+
+    With CASPER_SHARED_SNAPSHOTS=1 the process only memory-maps what shared_snapshot.py publishes,
+    so several dashboard processes on one host share a single copy of the data.
+    """
+    return (SharedSnapshotReader() if SHARED_SNAPSHOTS else RefreshWorker()).start()
+
+@st.cache_resource
+def get_view_cache():
+    """Figure/summary LRU shared by all sessions of this process"""
+    return ViewCache(maxsize=VIEW_CACHE_SIZE)
+
+@st.cache_resource(max_entries=16)
+def load_forecasts(_cube, version, time_period, metric, model):
+    """Forecasts of every series, fitted once per dataset version, grain, metric and model"""
+    return forecast_cube(_cube, time_period, metric, model)
+
 def main():
     st.set_page_config(page_title="Casper Sales Analysis", layout="wide")
     
     st.title("Casper Sales Data Analysis")
     st.markdown("---")
     
-    # Load data
-    @st.cache_data
-    def load_data():
-        return load_and_clean_data()
+    # Load data - cleaning and aggregation run on the refresh worker, requests only read its latest snapshot
+    worker = get_refresh_worker()
+    with st.spinner("Preparing data..."):
+        snapshot = worker.snapshot() # Only waits when nothing has been cleaned yet
+    if snapshot is None:
+        st.error("No data could be loaded.")
+        st.code(worker.error)
+        return
+    if worker.error:
+        st.sidebar.warning("The latest data refresh failed - showing the previous data.")
     
-    df = load_data()
+    @st.cache_resource(max_entries=8)
+    def load_period(_snapshot, version, start, end):
+        df, cube = period_view(_snapshot, start, end)
+        return df, cube, build_row_index(df)
+    
+    available_months = snapshot.months
     
     # Create sidebar for filters
     st.sidebar.header("Filters")
     
+    # Period range - only the partitions inside it are read (shared snapshots slice the mapped rows instead)
+    start_month, end_month = st.sidebar.select_slider(
+        "Period:",
+        options=available_months,
+        value=(available_months[0], available_months[-1])
+    )
+    
+    df, cube, row_index = load_period(snapshot, snapshot.version, start_month, end_month)
+    
     # Channel selection
     all_channels = sorted(df['Distribution channel'].unique())
     channel_options = ['ALL'] + all_channels
@@ -230,8 +372,26 @@ def main():
         help="Select 'ALL' to sum across all divisions"
     )
     
+    # Region selection
+    region_options = ['ALL'] + sorted(row_index['Region'])
+    selected_regions = st.sidebar.multiselect(
+        "Select Regions:",
+        options=region_options,
+        default=['ALL'],
+        help="Select 'ALL' to sum across all regions, or specific regions to plot one line each"
+    )
+    
+    # Type of product selection
+    product_options = ['ALL'] + sorted(row_index['Type of product'])
+    selected_products = st.sidebar.multiselect(
+        "Select Product Types:",
+        options=product_options,
+        default=['ALL'],
+        help="Select 'ALL' to sum across all product types, or specific types to plot one line each"
+    )
+    
     # Metric selection
-    metric_options = ['Sales amount', 'Total volume', 'Actual sales volume']
+    metric_options = ['Sales amount', 'Total volume', 'Actual sales volume'] + ROLLING_METRICS # YTD/TTM/3M avg are precomputed in the cube
     selected_metric = st.sidebar.selectbox(
         "Select Metric:",
         options=metric_options,
@@ -246,6 +406,14 @@ def main():
         index=0
     )
     
+    # Quarters are never cut by the range: the cube always holds whole quarters (see aggregates.cube_periods)
+    if selected_time_period == 'Quarter':
+        first_month, last_month = quarter_bounds(start_month, end_month)
+        if (first_month, last_month) != (start_month, end_month):
+            st.sidebar.caption(f"Quarter view covers whole quarters: {first_month} to {last_month}")
+        if first_month < available_months[0] or last_month > available_months[-1]:
+            st.sidebar.caption(f"Edge quarters are incomplete - data only covers {available_months[0]} to {available_months[-1]}")
+    
     # YoY option
     show_yoy = st.sidebar.checkbox(
         "Show YoY %",
@@ -253,117 +421,171 @@ def main():
         help="Display Year-over-Year percentage change"
     )
     
+    # Forecast overlay - the base measures only, and not on the YoY chart
+    forecast_available = selected_metric in ROLLING_BASES and not show_yoy
+    forecast_model = st.sidebar.selectbox(
+        "Forecast:",
+        options=['None'] + FORECAST_MODELS,
+        index=0,
+        disabled=not forecast_available,
+        help="Extend every plotted series with a forecast and its 80% band (not available for YoY % or rolling metrics)"
+    )
+    if not forecast_available:
+        forecast_model = 'None'
+    
     # Main content area
-    if selected_channels and selected_divisions:
+    if selected_channels and selected_divisions and selected_regions and selected_products:
+        # Views are cached on the normalized filter state, so repeat views skip all pandas work
+        view_cache = get_view_cache()
+        version = snapshot.version # Only a new dataset version drops cached views - the range is part of each key
+        period_range = (start_month, end_month)
+        channels_key = normalize_selection(selected_channels)
+        divisions_key = normalize_selection(selected_divisions)
+        regions_key = normalize_selection(selected_regions)
+        products_key = normalize_selection(selected_products)
+        selection_key = (channels_key, regions_key, divisions_key, products_key) # In DIMENSIONS order
+        
         # Create and display plot
-        fig = plot_sales_by_month(
-            df,
-            channels=selected_channels,
-            divisions=selected_divisions,
-            metric=selected_metric,
-            time_period=selected_time_period,
-            show_yoy=show_yoy
+        fig = view_cache.get_or_build(
+            version, ('figure', period_range, *selection_key, selected_metric, selected_time_period, show_yoy, forecast_model),
+            lambda: plot_sales_by_month(
+                cube,
+                channels=list(channels_key),
+                divisions=list(divisions_key),
+                metric=selected_metric,
+                time_period=selected_time_period,
+                show_yoy=show_yoy,
+                regions=regions_key,
+                products=products_key,
+                forecast=None if forecast_model == 'None' else load_forecasts(
+                    cube, (version, *period_range), selected_time_period, selected_metric, forecast_model),
+                history=snapshot.cube
+            )
         )
         st.plotly_chart(fig, use_container_width=True)
+        if not fig.data: # e.g. a product type picked together with a division it does not belong to
+            st.info("The selected channels, divisions, regions and product types have no sales together.")
         
         # Show summary statistics
         st.markdown("### Summary Statistics")
         
-        # Filter data for summary
-        if 'ALL' in selected_channels and 'ALL' in selected_divisions:
-            filtered_df = df.copy()
-        elif 'ALL' in selected_channels:
-            filtered_df = df[df['Division'].isin([d for d in selected_divisions if d != 'ALL'])].copy()
-        elif 'ALL' in selected_divisions:
-            filtered_df = df[df['Distribution channel'].isin([c for c in selected_channels if c != 'ALL'])].copy()
-        else:
-            filtered_df = df[
-                (df['Distribution channel'].isin(selected_channels)) & 
-                (df['Division'].isin(selected_divisions))
-            ].copy()
+        # As-of period and the comparison shown as the card deltas
+        as_of_col, compare_col = st.columns(2)
+        with as_of_col:
+            as_of = st.selectbox(
+                "As of:",
+                options=[None] + list(cube[selected_time_period].index.levels[-1][::-1]),
+                format_func=lambda period: "Latest" if period is None else period_label(period, selected_time_period),
+                help="Period the cards summarize - Latest is the most recent period of the selection"
+            )
+        sequential = SEQUENTIAL_CHANGE[selected_time_period]
+        comparisons = {'Same period last year': 'YoY %', f'Previous {selected_time_period.lower()}': f'{sequential} %', 'None': None}
+        with compare_col:
+            comparison = st.radio(
+                "Compare with:",
+                options=list(comparisons),
+                index=0 if show_yoy else 2,
+                horizontal=True
+            )
         
-        # Get only the latest period data
-        if selected_time_period == 'Quarter':
-            # Convert to quarter and get the latest
-            filtered_df['Quarter'] = pd.PeriodIndex(filtered_df['Month'], freq='Q')
-            latest_quarter = filtered_df['Quarter'].max()
-            latest_data = filtered_df[filtered_df['Quarter'] == latest_quarter]
-            period_label = str(latest_quarter)
-            
-            # Get same period last year for YoY
-            if show_yoy and latest_quarter.year > filtered_df['Quarter'].min().year:
-                same_quarter_last_year = pd.Period(year=latest_quarter.year - 1, quarter=latest_quarter.quarter, freq='Q')
-                last_year_data = filtered_df[filtered_df['Quarter'] == same_quarter_last_year]
-            else:
-                last_year_data = pd.DataFrame()
-        else:
-            # Get the latest month
-            latest_month = filtered_df['Month'].max()
-            latest_data = filtered_df[filtered_df['Month'] == latest_month]
-            period_label = latest_month.strftime('%B %Y')
-            
-            # Get same month last year for YoY
-            if show_yoy and latest_month.year > filtered_df['Month'].min().year:
-                same_month_last_year = latest_month - pd.DateOffset(years=1)
-                last_year_data = filtered_df[
-                    (filtered_df['Month'].dt.year == same_month_last_year.year) &
-                    (filtered_df['Month'].dt.month == same_month_last_year.month)
-                ]
-            else:
-                last_year_data = pd.DataFrame()
+        summary = view_cache.get_or_build(
+            version, ('summary', period_range, *selection_key, selected_time_period, as_of),
+            lambda: summarize(cube, selected_time_period, list(channels_key), list(divisions_key),
+                              regions_key, products_key, as_of=as_of, history=snapshot.cube)
+        )
         
         # Create columns for metrics
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            latest_sales = latest_data['Sales amount'].sum()
-            if show_yoy and not last_year_data.empty:
-                last_year_sales = last_year_data['Sales amount'].sum()
-                yoy_change = ((latest_sales - last_year_sales) / last_year_sales * 100) if last_year_sales != 0 else 0
+        change_column = comparisons[comparison]
+        for col, (label, measure, value_format) in zip(st.columns(len(SUMMARY_CARDS)), SUMMARY_CARDS):
+            with col:
+                value = summary.table.at[measure, 'Value']
+                change = summary.table.at[measure, change_column] if change_column else float('nan')
                 st.metric(
-                    f"Sales ({period_label})", 
-                    f"{latest_sales:,.1f}B VND",
-                    delta=f"{yoy_change:+.1f}%"
+                    f"{label} ({summary.label or 'no data'})",
+                    value_format.format(0 if pd.isna(value) else value),
+                    delta=None if pd.isna(change) else f"{change:+.1f}%"
                 )
-            else:
-                st.metric(f"Sales ({period_label})", f"{latest_sales:,.1f}B VND")
         
-        with col2:
-            latest_volume = latest_data['Total volume'].sum()
-            if show_yoy and not last_year_data.empty:
-                last_year_volume = last_year_data['Total volume'].sum()
-                yoy_change = ((latest_volume - last_year_volume) / last_year_volume * 100) if last_year_volume != 0 else 0
-                st.metric(
-                    f"Volume ({period_label})", 
-                    f"{latest_volume:,.0f} units",
-                    delta=f"{yoy_change:+.1f}%"
-                )
-            else:
-                st.metric(f"Volume ({period_label})", f"{latest_volume:,.0f} units")
+        # Sales bridge between two periods of the selection
+        with st.expander("Price / Volume / Mix Bridge"):
+            periods = list(cube[selected_time_period].index.levels[-1][::-1]) # Latest first
+            current_col, base_col = st.columns(2)
+            with current_col:
+                bridge_current = st.selectbox("To:", options=periods, index=0,
+                                              format_func=lambda period: period_label(period, selected_time_period))
+            last_year = shift_period(bridge_current, selected_time_period, PERIODS_PER_YEAR[selected_time_period])
+            with base_col:
+                bridge_base = st.selectbox("From:", options=periods,
+                                           index=periods.index(last_year) if last_year in periods else min(1, len(periods) - 1),
+                                           format_func=lambda period: period_label(period, selected_time_period))
+            st.plotly_chart(view_cache.get_or_build(
+                version, ('bridge', period_range, *selection_key, selected_time_period, bridge_base, bridge_current),
+                lambda: plot_price_volume_mix(
+                    price_volume_mix(cube, selected_time_period, bridge_base, bridge_current,
+                                     list(channels_key), list(divisions_key), regions_key, products_key),
+                    period_label(bridge_base, selected_time_period), period_label(bridge_current, selected_time_period))
+            ), use_container_width=True)
         
-        with col3:
-            latest_actual_volume = latest_data['Actual sales volume'].sum()
-            if show_yoy and not last_year_data.empty:
-                last_year_actual_volume = last_year_data['Actual sales volume'].sum()
-                yoy_change = ((latest_actual_volume - last_year_actual_volume) / last_year_actual_volume * 100) if last_year_actual_volume != 0 else 0
-                st.metric(
-                    f"Actual Volume ({period_label})", 
-                    f"{latest_actual_volume:,.0f} units",
-                    delta=f"{yoy_change:+.1f}%"
+        # Unusual moves, looked up in the anomaly table built when the data was loaded
+        if snapshot.anomalies is not None:
+            with st.expander("What changed"):
+                all_series = st.checkbox(
+                    "All series",
+                    value=False,
+                    help="List unusual moves of every channel/region/division/product combination, not just the plotted ones"
+                )
+                changes = view_cache.get_or_build(
+                    version, ('anomalies', period_range, *selection_key, all_series),
+                    lambda: anomaly_view(snapshot.anomalies, start_month, end_month,
+                                         dict(zip(DIMENSIONS, selection_key)), all_series)
                 )
-            else:
-                st.metric(f"Actual Volume ({period_label})", f"{latest_actual_volume:,.0f} units")
+                if changes.empty:
+                    st.write("No unusual changes in the selected period.")
+                else:
+                    st.caption("Month-over-month, year-over-year and seasonal changes far outside each series' own history "
+                               "(|robust z| of at least 3.5)")
+                    st.dataframe(changes, hide_index=True)
         
         # Show data table
         with st.expander("View Raw Data"):
-            st.dataframe(
-                filtered_df[['Month', 'Distribution channel', 'Division', 
-                           'Sales amount', 'Total volume', 'Actual sales volume']]
-                .sort_values('Month', ascending=False)
-                .head(100)
-            )
+            st.dataframe(view_cache.get_or_build(
+                version, ('raw data', period_range, *selection_key),
+                lambda: raw_data_preview(df, row_index, dict(zip(DIMENSIONS, selection_key)))
+            ))
+            
+            # Full extracts - files are written in chunks on a separate thread when a button is clicked.
+            # Rows are re-read at full precision from the range's partitions, in the order of df
+            export_format = st.selectbox("Export format:", options=list(EXPORT_FORMATS))
+            file_stem = f'casper_sales_{start_month}_{end_month}'
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    "Download filtered rows",
+                    data=lambda: export_file(period_rows(snapshot, start_month, end_month), export_format,
+                                             select_rows(row_index, dict(zip(DIMENSIONS, selection_key)))),
+                    file_name=f'{file_stem}_rows.{export_format}',
+                    mime=EXPORT_FORMATS[export_format],
+                    on_click='ignore'
+                )
+            with col2:
+                st.download_button(
+                    f"Download chart data (by {selected_time_period.lower()})",
+                    data=lambda: export_file(query(
+                        cube, channels=channels_key, divisions=divisions_key, regions=regions_key, products=products_key,
+                        metric=[m for m in METRICS if m in cube[selected_time_period].columns],
+                        grain=selected_time_period
+                    ), export_format),
+                    file_name=f'{file_stem}_by_{selected_time_period.lower()}.{export_format}',
+                    mime=EXPORT_FORMATS[export_format],
+                    on_click='ignore'
+                )
     else:
-        st.warning("Please select at least one channel and one division.")
+        st.warning("Please select at least one channel, division, region and product type.")
+    
+    # Stage timings of this process (cleaning, cube builds, views), shown with ?debug=1 in the URL
+    if st.query_params.get('debug') == '1':
+        with st.expander("Pipeline timings", expanded=True):
+            st.dataframe(stage_table(), hide_index=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
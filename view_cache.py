@@ -0,0 +1,49 @@
+# %%
+import threading
+from collections import OrderedDict
+from aggregates import ALL
+
+#%%
+def normalize_selection(values):
+    """Cache-key form of a multiselect: ('ALL',) if ALL is picked, else the sorted unique values"""
+    return (ALL,) if ALL in values else tuple(sorted(set(values)))
+
+class ViewCache:
+    """Bounded LRU of built views (figures, summaries) shared by every session of the process
+
+    Entries belong to one dataset version - asking with a different version drops them all.
+    Anything else a view depends on (selection, period range, ...) goes into its key.
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, version, key, build):
+        """Return the cached view for key, calling build() only on a miss"""
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = build() # Built outside the lock so other sessions are not blocked
+
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()